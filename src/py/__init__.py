@@ -1,11 +1,8 @@
 """
 Search to notes main application
 """
-import os, codecs, tempfile, requests, base64, time, logging, ssl, subprocess
-from collections import OrderedDict
-from requests.adapters import HTTPAdapter
-from urllib3.poolmanager import PoolManager
-from urllib3.util.ssl_ import create_urllib3_context
+import os, codecs, base64, time, logging
+from dataclasses import dataclass
 from aqt import mw, gui_hooks
 from aqt.qt import *
 from aqt.utils import *
@@ -14,18 +11,18 @@ from anki import consts, collection
 from .consts import *
 from .engine import *
 from .ankiutils import *
+from .pipeline import QueryPipeline
+from .cache import DownloadCache, SearchCache
+from .imagemodel import MatchListModel
+from .thumbs import ThumbnailCache, ZoomCache, read_scaled
+from .media import MediaFile, prepare_media
+from .filters import SizeFilter
 from .translations import translations
 
-if sys.platform == 'win32' or sys.platform == 'cygwin':
-    CURL = "curl.exe" if shutil.which('curl.exe') else None
-else:
-    CURL = "curl" if shutil.which('curl') else None
-
 if qtmajor == 6:
     from . import mainwindow_qt6 as ui_mainwindow, enterdialog_qt6 as ui_enterdialog, imagedialog_qt6 as ui_imagedialog, listdialog_qt6 as ui_listdialog
 elif qtmajor == 5:
     from . import mainwindow_qt5 as ui_mainwindow, enterdialog_qt5 as ui_enterdialog, imagedialog_qt5 as ui_imagedialog, listdialog_qt5 as ui_listdialog
-from . import imghdr
 
 CVER = get_version()
 NVER = "1.2.0"
@@ -54,6 +51,17 @@ class ListDialog(QDialog):
 
 
 
+@dataclass
+class GenerateResult:
+    """
+    Result of note generation (`changes` for `CollectionOp`)
+    """
+    changes: collection.OpChanges
+    count: int
+    skipped: list[str]
+    note_type: int
+
+
 class MainWindow(QMainWindow):
     """
     Main window
@@ -61,15 +69,36 @@ class MainWindow(QMainWindow):
     logger = logging.getLogger('S2N')
     terms: list[Term] = []
     last_dir = ""
-    tmp_dir: str = None
     thumbw = 200
     thumbh = 200
     img_h = -1
     img_w = -1
+    img_resize = False
+    img_format = ""
+    img_quality = 85
+    download_concurrency = 8
+    download_batch = True
+    download_pool_size = 10
+    download_max_size = 20
+    cache: DownloadCache = None
+    search_cache: SearchCache = None
+    search_concurrency = 2
+    search_rate = 1.0
+    search_retries = 3
+    thumbs: ThumbnailCache = None
+    prefetch_terms = 3
+    prefetch_memory = 32
+    dup_distance = 4
+    dup_terms = False
+    size_filter: SizeFilter = None
+    probe = 'off'
+    probe_size = 16
+    zoom_cache: ZoomCache = None
     cloze_table = ""
     cloze_td = ""
     engines: list[Engine] = None
     engine: Engine = None
+    pipeline: QueryPipeline = None # Pipeline of current results (running or finished)
 
     def __init__(self):
         """
@@ -89,7 +118,7 @@ class MainWindow(QMainWindow):
         self.ui.generate.clicked.connect(self.generate_notes)
         self.ui.close.clicked.connect(self.close)
         self.ui.term_lv.currentItemChanged.connect(self.set_current_term)
-        self.ui.image_lv.customContextMenuRequested.connect(lambda point: self.zoom_image(self.ui.term_lv.currentRow(), self.ui.image_lv.row(self.ui.image_lv.itemAt(point))) if self.ui.image_lv.itemAt(point) else None)
+        self.ui.image_lv.customContextMenuRequested.connect(lambda point: self.zoom_image(self.ui.image_lv.indexAt(point).row()) if self.ui.image_lv.indexAt(point).isValid() else None)
         sc = QShortcut(QKeySequence('Ctrl+Return'), self)
         sc.activated.connect(self.ui.generate.click)
 
@@ -118,11 +147,22 @@ class MainWindow(QMainWindow):
         self.img_dlg_ui = ui_imagedialog.Ui_ImageDialog()
         self.img_dlg_ui.setupUi(self.img_dlg)
         self.img_dlg_ui.gfx.mousePressEvent = self.img_dlg_mousepressevent
+        self.zoom_cache = ZoomCache(self, ZOOM_CACHE_SIZE, self.logger)
         sc = QShortcut(QKeySequence('Return'), self.ui.image_lv)
-        sc.activated.connect(lambda: self.zoom_image(self.ui.term_lv.currentRow(), self.ui.image_lv.currentRow()) if self.ui.image_lv.hasFocus() else None)
+        sc.activated.connect(lambda: self.zoom_image(self.ui.image_lv.currentIndex().row()) if self.ui.image_lv.hasFocus() else None)
         sc = QShortcut(QKeySequence('Return'), self.img_dlg)
         sc.activated.connect(lambda: self.img_dlg.close())
 
+        # Query progress, in status bar to keep window usable while running
+        self.progress = QProgressBar(self)
+        self.progress.setMaximumWidth(300)
+        self.statusBar().addPermanentWidget(self.progress)
+        self.cancel = QPushButton(t('Cancel'), self)
+        self.cancel.setAutoDefault(False)
+        self.cancel.clicked.connect(lambda: self.pipeline.cancel() if self.pipeline else None)
+        self.statusBar().addPermanentWidget(self.cancel)
+        self.set_running(False)
+
         # Load user config and restore states
         self.load_config()
         self.show()
@@ -133,6 +173,7 @@ class MainWindow(QMainWindow):
         """
         Main dialog window "destructor" - actual destructor too late
         """
+        self.stop_pipeline()
         self.save_state()
 
 
@@ -169,13 +210,65 @@ class MainWindow(QMainWindow):
         self.iconw = config.get(CFG_THUMBW, 200)
         self.iconh = config.get(CFG_THUMBH, 200)
         self.ui.image_lv.setIconSize(QSize(self.iconw, self.iconh))
+        self.thumbs = ThumbnailCache(
+            self,
+            self.iconw,
+            self.iconh,
+            config.get(CFG_THUMB_CACHE, 100) * 1024 * 1024,
+            self.logger
+        )
+        self.image_model = MatchListModel(self, self.thumbs)
+        self.prefetch_terms = config.get(CFG_PREFETCH, self.prefetch_terms)
+        self.prefetch_memory = config.get(CFG_PREFETCH_MEMORY, self.prefetch_memory)
+        self.ui.image_lv.setModel(self.image_model)
+        self.ui.image_lv.selectionModel().selectionChanged.connect(self.image_model.selection_changed)
 
         # Image size
         if v := config.get(CFG_IMGH):
             self.img_h = v
         if v := config.get(CFG_IMGW):
             self.img_w = v
-        
+        self.img_resize = config.get(CFG_IMG_RESIZE, False)
+        self.img_format = config.get(CFG_IMG_FORMAT, '')
+        self.img_quality = config.get(CFG_IMG_QUALITY, 85)
+
+        # Searching
+        if v := config.get(CFG_SEARCH_CONCURRENCY):
+            self.search_concurrency = v
+        self.search_rate = config.get(CFG_SEARCH_RATE, self.search_rate)
+        self.search_retries = config.get(CFG_SEARCH_RETRIES, self.search_retries)
+        self.dup_distance = config.get(CFG_DUP_DISTANCE, self.dup_distance)
+        self.dup_terms = config.get(CFG_DUP_TERMS, self.dup_terms)
+        filt = config.get(CFG_FILTER, {})
+        self.size_filter = SizeFilter(
+            filt.get(CFG_FILTER_MIN_W, 0),
+            filt.get(CFG_FILTER_MIN_H, 0),
+            filt.get(CFG_FILTER_MAX_W, 0),
+            filt.get(CFG_FILTER_MAX_H, 0),
+            filt.get(CFG_FILTER_MIN_ASPECT, 0),
+            filt.get(CFG_FILTER_MAX_ASPECT, 0),
+            filt.get(CFG_FILTER_MAX_PIXELS, 0)
+        )
+        self.probe = config.get(CFG_PROBE, self.probe)
+        self.probe_size = config.get(CFG_PROBE_SIZE, self.probe_size)
+
+        # Downloading
+        if v := config.get(CFG_DL_CONCURRENCY):
+            self.download_concurrency = v
+        self.download_batch = config.get(CFG_DL_BATCH, True)
+        if v := config.get(CFG_DL_POOL):
+            self.download_pool_size = v
+        self.download_max_size = config.get(CFG_DL_MAX_SIZE, self.download_max_size)
+        if v := config.get(CFG_CACHE_SIZE, 500):
+            self.cache = DownloadCache(CACHE_DIR, v * 1024 * 1024, self.logger)
+            self.thumbs.cache = self.cache
+        if v := config.get(CFG_SEARCH_TTL, 24):
+            self.search_cache = SearchCache(
+                SEARCH_CACHE_FILE if config.get(CFG_SEARCH_DISK, True) else None,
+                v * 3600,
+                self.logger
+            )
+
         # Cloze formating
         if v := config.get(CFG_CLOZE_TABLE):
             self.cloze_table = v
@@ -249,15 +342,42 @@ class MainWindow(QMainWindow):
         }
         mw.addonManager.writeConfig(__name__, config)
 
+    def set_running(self, running: bool):
+        """
+        Show/hide query progress and enable/disable starting a new query
+        """
+        self.progress.setVisible(running)
+        self.cancel.setVisible(running)
+        self.ui.search.setEnabled(not running)
+        if not running:
+            self.statusBar().clearMessage()
+
+    def stop_pipeline(self):
+        """
+        Cancel query pipeline without blocking the GUI, it winds down in the
+        background (parented to `mw` to outlive this window) and removes its
+        temporary files once finished
+        """
+        if not self.pipeline: return
+        (pipeline, self.pipeline) = (self.pipeline, None)
+        pipeline.cancel()
+        self.thumbs.clear()
+        self.zoom_cache.clear()
+        pipeline.setParent(mw)
+        pipeline.dispose()
+        self.set_running(False)
+
     def reset(self):
         """
         Clear/reset terms, matches, deleting temporary image files etc.
         """
+        self.stop_pipeline()
         self.ui.image_lv.setEnabled(False)
         self.ui.generate.setEnabled(False)
         self.terms.clear()
         self.ui.term_lv.clear()
-        self.ui.image_lv.clear()
+        self.image_model.set_matches([])
+        self.thumbs.clear()
 
     def select_file(self):
         """
@@ -295,78 +415,77 @@ class MainWindow(QMainWindow):
 
     def set_current_term(self, current, previous):
         """
-        Term selected - store old image selection and setup new
+        Term selected - setup image lv with the term's matches and their
+        selection (image lv is a view on the matches, selection changes are
+        written to the matches as they happen)
         """
-
-        def scale(file: str):
-            # Create a new QImage with desired size, initialized to transparent color
-            pixmap = QPixmap(file).scaled(
-                self.iconw,
-                self.iconh,
-                Qt.AspectRatioMode.KeepAspectRatio
-            )
-            img = QImage(self.iconw, self.iconh, QImage.Format.Format_ARGB32)
-            img.fill(Qt.GlobalColor.transparent)
-            painter = QPainter(img)
-            x = (self.iconw - pixmap.width()) / 2
-            y = (self.iconh - pixmap.height()) / 2
-            painter.drawPixmap(x, y, pixmap)
-            painter.end()
-            return QPixmap.fromImage(img)
-
         if self.ui.image_lv.isEnabled():
-            # Store previous selection then clear image lv
-            self.store_image_selection()
-            self.ui.image_lv.clear()
+            self.image_model.set_matches([])
 
             if current: # If new selected term setup image lv
                 i = self.ui.term_lv.row(current)
-                for (ii, match) in enumerate(self.terms[i].matches):
-                    if match.file:
-                        img_itm = QListWidgetItem(match.title)
-                        img_itm.setData(TERM_ROLE, i)
-                        img_itm.setIcon(QIcon(scale(match.file)))
-                        img_itm.setToolTip(match.url)
-                        self.ui.image_lv.addItem(img_itm)
-                        if ii == 0: # Needs to be done before setSeleced to avoid toggle
-                            self.ui.image_lv.setCurrentRow(0)
-                        img_itm.setSelected(match.selected)
-                    else:
+                if self.pipeline:
+                    self.pipeline.set_focus(i)
+                self.prefetch_thumbnails(i, -1 if previous and self.ui.term_lv.row(previous) > i else 1)
+                for match in self.terms[i].matches:
+                    if not match.file:
                         self.logger.warning(f"No file found for: {match}")
-                if self.ui.image_lv.count():
+                self.image_model.set_matches(self.terms[i].matches)
+                self.prefetch_zoom()
+                if self.image_model.rowCount():
+                    sel_model = self.ui.image_lv.selectionModel()
+                    # Needs to be done before select to avoid toggle
+                    sel_model.setCurrentIndex(self.image_model.index(0), QItemSelectionModel.SelectionFlag.NoUpdate)
+                    selection = QItemSelection()
+                    for row, match in enumerate(self.image_model.matches):
+                        if match.selected:
+                            selection.select(self.image_model.index(row), self.image_model.index(row))
+                    sel_model.select(selection, QItemSelectionModel.SelectionFlag.Select)
                     self.ui.image_lv.scrollToTop()
                     self.ui.image_lv.setFocus()
                     
 
-    def store_image_selection(self):
+    def prefetch_thumbnails(self, index: int, step: int):
         """
-        Store image selection
+        Queue thumbnails of the next terms in navigation direction (step)
+        within the prefetch memory budget (at most half the thumbnail cache),
+        pinning them and the current term's so thumbnails generated for other
+        downloads do not evict them
         """
-        for itm in self.ui.image_lv.findItems("*", Qt.MatchFlag.MatchWildcard):
-            ti = itm.data(TERM_ROLE)
-            ii = self.ui.image_lv.row(itm)
-            
-            # Sanity checks for debug
-            if ti < 0 or ii < 0:
-                self.logger.warning(f"Image_lv index error|ti: {ti}|ii: {ii}|terms: {self.terms}")
-            elif ti >= len(self.terms):
-                self.logger.warning(f"Image_lv > terms|ti: {ti}|ii: {ii}|terms: {self.terms}")
-            elif ii >= len(self.terms[ti].matches):
-                self.logger.warning(f"Image_lv > term matches|ti: {ti}|ii: {ii}|term.matches: {self.terms[ti].matches}")
-            else:
-                self.terms[ti].matches[ii].selected = itm.isSelected()
+        budget = min(self.prefetch_memory * 1024 * 1024, self.thumbs.max_size // 2)
+        files = [match.file for match in self.terms[index].matches if match.file]
+        prefetch = []
+        for i in range(index + step, index + step * (self.prefetch_terms + 1), step):
+            if not 0 <= i < len(self.terms):
+                break
+            for match in self.terms[i].matches:
+                if match.file and (budget := budget - self.iconw * self.iconh * 4) >= 0:
+                    prefetch.append(match.file)
+        self.thumbs.pin(files + prefetch)
+        for file in prefetch:
+            self.thumbs.request(file, 1)
+
+    def prefetch_zoom(self):
+        """
+        Queue zoom sized images of the current term's matches
+        """
+        self.zoom_cache.clear()
+        geom = self.img_dlg.geometry()
+        self.zoom_cache.resize(geom.width(), geom.height())
+        for match in self.image_model.matches:
+            self.zoom_cache.request(match.file)
 
-    def zoom_image(self, term_index, match_index):
+    def zoom_image(self, row):
         """
-        Show zoomed image of supplied term and match index
+        Show zoomed image of supplied image lv row
         """
-        if term_index < self.ui.term_lv.count() and match_index < self.ui.image_lv.count():
-            self.img_dlg.setWindowTitle(self.terms[term_index].matches[match_index].title)
+        if match := self.image_model.match_at(row):
+            self.img_dlg.setWindowTitle(match.title)
             geom = self.img_dlg.geometry()
-            self.img_dlg_ui.gfx.setPixmap(
-                QPixmap(self.terms[term_index].matches[match_index].file)
-                .scaled(geom.width(), geom.height(), Qt.AspectRatioMode.KeepAspectRatio)
-            )
+            self.zoom_cache.resize(geom.width(), geom.height())
+            if not (img := self.zoom_cache.get(match.file)):
+                img = read_scaled(match.file, geom.width(), geom.height())
+            self.img_dlg_ui.gfx.setPixmap(QPixmap.fromImage(img))
             self.img_dlg.show()
 
 
@@ -413,99 +532,12 @@ class MainWindow(QMainWindow):
 
     def run_query(self):
         """
-        Run search query and populate term-images, runs in main thread with custom
-        progress bar
+        Run search query and populate term-images, searching and downloading
+        runs in a background pipeline, progress in status bar and each term's
+        images shown as soon as they are ready
         """
 
-        def curl_download(url: str):
-            """Attempt to download URL using `curl`, return tuple (status_code, file)"""
-            tmp = tempfile.NamedTemporaryFile(
-                mode='wb',
-                suffix='.jpg',
-                dir=self.tmp_dir.name,
-                delete=False
-            )
-            proc_info = subprocess.run(
-                [
-                    CURL,
-                    '-H', 'User-Agent: Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/103.0.5060.114 Safari/537.36, Accept-Encoding:gzip,deflate',
-                    '--connect-timeout', '5',
-                    '-o', tmp.name,
-                    '-L',                   # follow redirect
-                    '-s',                   # silent
-                    '-w', '%{http_code}',   # write final status_code to stdout
-                    '-X', 'GET', url
-                ],
-                stdout=subprocess.PIPE,
-                universal_newlines=True
-            )
-            try:
-                code = int(proc_info.stdout.strip())
-            except:
-                code = 400
-            return (code, tmp.name)
-
-        def requests_download(url: str):
-            """
-            Attempt to download URL with `requests`, return tuple (status_code, file)
-            """
-            # Some anti-fingerprinting stuff to be able to download
-            class TlsAdapter(HTTPAdapter):
-                """
-                Class to counter TLS fingerprinting
-                https://scrapfly.io/blog/how-to-avoid-web-scraping-blocking-tls/
-                """
-                def __init__(self, ssl_options=0, **kwargs):
-                    self.ssl_options = ssl_options
-                    super(TlsAdapter, self).__init__(**kwargs)
-
-                def init_poolmanager(self, *pool_args, **pool_kwargs):
-                    # see "openssl ciphers" command for cipher names
-                    ctx = create_urllib3_context(
-                        ciphers="ECDHE-RSA-AES256-GCM-SHA384:ECDHE-ECDSA-AES256-GCM-SHA384", cert_reqs=ssl.CERT_REQUIRED,
-                        options=self.ssl_options
-                    )
-                    self.poolmanager = PoolManager(*pool_args, ssl_context=ctx, **pool_kwargs)
-
-            session = requests.Session()
-            session.mount(
-                "https://",
-                TlsAdapter(ssl.OP_NO_TLSv1 | ssl.OP_NO_TLSv1_1) # prio TLS1.2 
-            )
-            res = session.get(
-                url = url,
-                headers = OrderedDict([
-                    ('Upgrade-Insecure-Requests', '1'),
-                    ('User-Agent', 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/103.0.5060.114 Safari/537.36'),
-                    ('Accept', 'text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,*/*;q=0.8'),
-                    ('Accept-Encoding', 'gzip, deflate'),
-                    ('Accept-Language', 'en-US,en;q=0.5')
-                ]),
-                allow_redirects=True,
-                stream = True,
-                timeout = 15,
-                verify=False
-            )
-            if res.status_code != 200:
-                self.logger.info(f"Non-200 return|match: {match}")
-                return (res.status_code, None)
-
-            res.raw.decode_content = True
-            if e := imghdr.what(file=None, h=res.content):
-                ext = f".{e}"
-            else:
-                self.logger.info(f"Unable to detect image type for {match.url}")
-                ext = ".jpg"
-            tmp = tempfile.NamedTemporaryFile(
-                mode='wb',
-                suffix=ext,
-                dir=self.tmp_dir.name,
-                delete=False
-            )
-            for chunk in res: tmp.file.write(chunk)
-            return (res.status_code, tmp.name)
-
-        if not self.terms: return
+        if not self.terms or self.pipeline and self.pipeline.isRunning(): return
 
         # Confirm with user
         template = self.ui.query_tpl.text()
@@ -518,115 +550,149 @@ class MainWindow(QMainWindow):
         dlg.ui.buttonBox.addButton(QDialogButtonBox.StandardButton.Cancel)
         if dlg.exec() != 1: return
         
-        # Setup
-        progress = QProgressDialog(parent=self, minimum=0, maximum=len(self.terms))
-        progress.setWindowModality(Qt.WindowModality.WindowModal)
-        progress.setFixedWidth(400)
-        lbl = QLabel(progress)
-        lbl.setFixedWidth(400)
-        lbl.setText(t('Getting images...'))
-        progress.setLabel(lbl)
-        progress.setAutoClose(False)
-        progress.forceShow()
-        mw.app.processEvents()
-        if progress.wasCanceled(): return
-
-        # Run queries
-        cnt = 0
+        # Setup, images are shown per term as they become ready
+        self.stop_pipeline()
+        if self.cache: self.cache.unpin()
+        pending = QBrush(self.palette().color(QPalette.ColorGroup.Disabled, QPalette.ColorRole.Text))
         for i, term in enumerate(self.terms):
-            query = term.query(template)
-            progress.setLabelText(t('Searching %(query)s...') % {'query': query})
-            progress.setValue(i)
-            mw.app.processEvents()
-            if progress.wasCanceled(): return
-            term.matches = self.engine.search(query)
-            if term.matches is None:
-                msg = t('%(engine)s search for "%(query)s" returned None, search engine plugin broken?') % {'engine': self.engine.title(), 'query': query}
-                self.logger.warning(msg)
-                raise Exception(msg)
-            cnt += len(term.matches)
-        progress.setValue(len(self.terms))
-        
-        # Download images
-        if self.tmp_dir: self.tmp_dir.cleanup()
-        self.tmp_dir = tempfile.TemporaryDirectory()
-        progress.setValue(0)
-        progress.setMaximum(cnt)
-        progress.setAutoClose(True)
-        mw.app.processEvents()
-        if progress.wasCanceled(): return
-        i = 0
+            term.matches = []
+            itm = self.ui.term_lv.item(i)
+            itm.setForeground(pending)
+            itm.setToolTip(t('Searching/downloading...'))
         all_skipped = {}
-        requests.packages.urllib3.disable_warnings(
-            requests.packages.urllib3.exceptions.InsecureRequestWarning
-        )
-        for term in self.terms:
-            matches = []
-            skipped = []
-            for match in term.matches:
-                progress.setLabelText(t('Downloading `%(url)s`...') % {'url': match.url})
-                progress.setValue(i)
-                mw.app.processEvents()
-                if progress.wasCanceled(): return
-                i += 1
-                try:
-                    if CURL: (status_code, file) = curl_download(match.url)
-                    else: (status_code, file) = requests_download(match.url)
-                    if status_code == 200:
-                        match.file = file
-                        matches.append(match)
-                    else:
-                        skipped.append(f'{match.url} ({status_code})')
-                except Exception as e:
-                    self.logger.info(f'Exception `{match.url}`: {e}')
-                    skipped.append(f'{match.url} ({e})')
- 
-            term.matches = matches
-            if skipped:
-                all_skipped[term.term] = skipped
-        progress.setValue(cnt)
-
-        # Update GUI
-        self.ui.generate.setEnabled(True)
+        ready = set()
+        self.progress.setRange(0, len(self.terms))
+        self.progress.setValue(0)
+        self.statusBar().showMessage(t('Getting images...'))
+        self.set_running(True)
+        self.ui.generate.setEnabled(False)
+        self.ui.image_lv.setEnabled(True)
         if self.ui.term_lv.currentRow() == 0:
             self.ui.term_lv.setCurrentRow(-1)
-        self.ui.image_lv.setEnabled(True)
         self.ui.term_lv.setCurrentRow(0)
 
-        # Alert user to skipped images
-        if all_skipped:
-            msg = ''
-            for k, v in all_skipped.items():
-                msg += f'{k}:<ul><li>{"</li><li>".join(v)}</li></ul>'
-            box = show_info(title=t('The following images were found but not downloaded'), text=msg, parent=self)
-            box.setTextFormat(Qt.TextFormat.RichText)
+        def progressed(done: int, total: int, text: str):
+            if pipeline is not self.pipeline: return # Terms reset
+            self.progress.setMaximum(total)
+            self.progress.setValue(done)
+            self.statusBar().showMessage(text)
+
+        def term_done(index: int, matches: list[Match], skipped: list[str]):
+            if pipeline is not self.pipeline: return # Terms reset
+            self.terms[index].matches = matches
+            ready.add(index)
+            if skipped:
+                all_skipped[self.terms[index].term] = skipped
+            itm = self.ui.term_lv.item(index)
+            itm.setData(Qt.ItemDataRole.ForegroundRole, None)
+            itm.setToolTip(t('%(count)d image(s)') % {'count': len(matches)})
+            if index == self.ui.term_lv.currentRow():
+                self.set_current_term(itm, itm)
+
+        def finished():
+            """Update GUI and alert user to skipped images"""
+            if pipeline is not self.pipeline: return # Terms reset
+            self.set_running(False)
+            self.ui.generate.setEnabled(True)
+            for i in set(range(len(self.terms))) - ready: # Cancelled/failed
+                self.ui.term_lv.item(i).setData(Qt.ItemDataRole.ForegroundRole, None)
+                self.ui.term_lv.item(i).setToolTip(t('Not searched (cancelled)'))
+
+            if all_skipped:
+                msg = ''
+                for k, v in all_skipped.items():
+                    msg += f'{k}:<ul><li>{"</li><li>".join(v)}</li></ul>'
+                box = show_info(title=t('The following images were found but not downloaded'), text=msg, parent=self)
+                box.setTextFormat(Qt.TextFormat.RichText)
+
+        # Run queries and downloads in background
+        pipeline = self.pipeline = QueryPipeline(
+            self,
+            self.engine,
+            [term.query(template) for term in self.terms],
+            self.logger,
+            concurrency=self.download_concurrency,
+            batch=self.download_batch,
+            pool_size=self.download_pool_size,
+            cache=self.cache,
+            search_cache=self.search_cache,
+            search_concurrency=self.search_concurrency,
+            search_rate=self.search_rate,
+            search_retries=self.search_retries,
+            thumbs=self.thumbs,
+            dup_distance=self.dup_distance,
+            dup_terms=self.dup_terms,
+            size_filter=self.size_filter,
+            probe=self.probe,
+            probe_size=self.probe_size * 1024,
+            max_size=int(self.download_max_size * 1024 * 1024)
+        )
+        pipeline.progress.connect(progressed)
+        pipeline.term_done.connect(term_done)
+        pipeline.failed.connect(lambda msg: show_warning(msg, parent=self))
+        pipeline.finished.connect(finished)
+        pipeline.start()
 
 
     def generate_notes(self):
         """
         Generate notes from term-images
         """
-        self.store_image_selection() # To store last selections
         deck = self.ui.deck.currentData()
         note_type_id = self.ui.note.currentData()
         prompt = self.ui.prompt.currentData()
         term_fld = self.ui.term.currentText()
         image_fld = self.ui.image.currentText()
         title = self.ui.title.text()
+        media_dir = os.path.join(self.pipeline.dir, 'media')
 
         def background(col):
             """
             Function for running note generation in background thread
             """
-            def scale_img(match: Match):
+            def scale_img(width: int, height: int):
                 """
                 Calculate how to scale image
                 """
-                if (self.img_w < 0 or match.width <= self.img_w) and (self.img_h < 0 or match.height <= self.img_h):
+                if not width or not height or (self.img_w < 0 or width <= self.img_w) and (self.img_h < 0 or height <= self.img_h):
                     return None
-                rw = self.img_w/match.width
-                rh = self.img_h/match.height
-                return (self.img_w, match.height*rw) if rw < rh else (match.width*rh, self.img_h)
+                rw = self.img_w/width
+                rh = self.img_h/height
+                return (self.img_w, height*rw) if rw < rh else (width*rh, self.img_h)
+
+            # Prepare (resize/recompress, hash, measure) all selected images in
+            # parallel, the collection is only touched to add each content once
+            media = prepare_media(
+                list({m.file for term in self.terms for m in term.matches if m.selected and m.file}),
+                media_dir,
+                self.img_w,
+                self.img_h,
+                self.img_resize,
+                self.img_format,
+                self.img_quality,
+                self.logger
+            )
+            added: dict[str, str] = {}
+
+            def selected(term: Term) -> list[MediaFile]:
+                """
+                Prepared images of term's selected matches, duplicates (same content) removed
+                """
+                files = {}
+                for match in term.matches:
+                    if match.selected and (prepared := media.get(match.file)):
+                        files.setdefault(prepared.hash, prepared)
+                return list(files.values())
+
+            def img_tag(prepared: MediaFile):
+                """
+                Add image to media (once per content) and return its <img> tag
+                """
+                if not (file := added.get(prepared.hash)):
+                    file = added[prepared.hash] = mw.col.media.add_file(prepared.file)
+                dim = scale_img(prepared.width, prepared.height)
+                dim = f' width="{dim[0]}" height="{dim[1]}"' if dim else ""
+                return f'<img src="{file}"{dim}>'
             
             def clozes(terms: list[Term], note_t):
                 """
@@ -634,17 +700,12 @@ class MainWindow(QMainWindow):
                 """
                 content = ""
                 cnt = 0
-                changes = []
+                notes = []
                 skipped = []
                 for term in self.terms:
-                    if matches := [m for m in term.matches if m.selected]:
+                    if images := selected(term):
                         cnt += 1
-                        images = ""
-                        for match in matches:
-                            file = mw.col.media.add_file(match.file)
-                            dim = scale_img(match)
-                            dim = f' width="{dim[0]}" height="{dim[1]}"' if dim else ""
-                            images += f'<img src="{file}"{dim}><br>'                            
+                        images = "".join(f'{img_tag(prepared)}<br>' for prepared in images)
                         if prompt == CLOZE_PROMPT_TERM:
                             content += f'{term.term}: {{{{c{str(cnt)}::{images[:-4]}}}}}<br>'
                         else:
@@ -658,44 +719,50 @@ class MainWindow(QMainWindow):
                     if term_fld != t('<none>'):
                         note[term_fld] = title
                     note[image_fld] = content
-                    # Fixme: correct way to store changes
-                    changes.append(mw.col.add_note(note, deck))
+                    notes.append(note)
                 
-                return (cnt, changes, skipped)
+                return (cnt, notes, skipped)
 
             def standards(terms: list[Term], note_t):
                 """Generate standard notes from terms"""
                 cnt = 0
-                changes = []
+                notes = []
                 skipped = []
                 for term in self.terms:
-                    if matches := [m for m in term.matches if m.selected]:
+                    if images := selected(term):
                         note = mw.col.new_note(note_t)
                         note[term_fld] = term.term
-                        for match in matches:
-                            file = mw.col.media.add_file(match.file)
-                            dim = scale_img(match)
-                            dim = f' width="{dim[0]}" height="{dim[1]}"' if dim else ""
-                            note[image_fld] += f'<img src="{file}"{dim}>'
+                        for prepared in images:
+                            note[image_fld] += img_tag(prepared)
                         if note[image_fld]:
-                            # Fixme: correct way to store changes
-                            changes.append(mw.col.add_note(note, deck))
+                            notes.append(note)
                             cnt += 1
                         else:  # No selected matches for term
                             skipped.append(term.term)
                     else: # No matches or no selected matches
                         skipped.append(term.term)
                 
-                return (cnt, changes, skipped)
+                return (cnt, notes, skipped)
+
+            def add_notes(notes: list) -> collection.OpChanges:
+                """
+                Add all notes in one operation (one undo entry)
+                """
+                if hasattr(collection, 'AddNoteRequest'): # Bulk add API of newer Anki versions
+                    return col.add_notes([collection.AddNoteRequest(note, deck) for note in notes])
+                pos = col.add_custom_undo_entry(t('Search to notes'))
+                for note in notes:
+                    col.add_note(note, deck)
+                return col.merge_undo_entries(pos)
 
             ###
             note_type = col.models.get(note_type_id)
             if note_type['type'] == consts.MODEL_CLOZE:
-                (cnt, changes, skipped) = clozes(self.terms, note_type)
+                (cnt, notes, skipped) = clozes(self.terms, note_type)
             else:
-                (cnt, changes, skipped) = standards(self.terms, note_type)
+                (cnt, notes, skipped) = standards(self.terms, note_type)
 
-            return type('obj', (object,), {'changes' : collection.OpChanges, 'skipped': skipped, 'count': cnt, 'note_type': note_type['type']})()
+            return GenerateResult(add_notes(notes), cnt, skipped, note_type['type'])
         
         def finished(result):
             """
@@ -0,0 +1,179 @@
+"""Persistent download and search result caches"""
+
+import os, time, json, glob, shutil, hashlib, sqlite3, threading, logging
+from . import imghdr
+from .engine import Engine, Match
+
+class DownloadCache:
+    """
+    Content addressed on-disk cache of downloaded images. Files are stored as
+    `<sha256 of content>.<ext>` (so the same image from several URLs is only
+    stored once) and indexed by URL in an SQLite database. When the total size
+    exceeds `max_size` bytes the least recently used files are evicted, except
+    files handed out during the current session (pinned). Thumbnails stored
+    next to a file (`<file>.thumb*.png`) count towards its size (`add_size`)
+    and are removed with it.
+    """
+    def __init__(self, dir: str, max_size: int, logger: logging.Logger):
+        self.dir = dir
+        self.max_size = max_size
+        self.logger = logger
+        self.pinned: set[str] = set()
+        self.lock = threading.Lock()
+        os.makedirs(dir, exist_ok=True)
+        self.db = sqlite3.connect(os.path.join(dir, 'index.db'), check_same_thread=False)
+        self.db.executescript(
+            'CREATE TABLE IF NOT EXISTS urls (url TEXT PRIMARY KEY, hash TEXT NOT NULL);'
+            'CREATE TABLE IF NOT EXISTS files (hash TEXT PRIMARY KEY, file TEXT NOT NULL, size INTEGER NOT NULL, atime REAL NOT NULL);'
+            'CREATE INDEX IF NOT EXISTS files_atime ON files (atime);'
+        )
+        self.size = self.db.execute('SELECT COALESCE(SUM(size), 0) FROM files').fetchone()[0]
+
+    def get(self, url: str) -> str:
+        """Return path of cached file for URL or None, marks file as used"""
+        with self.lock:
+            row = self.db.execute(
+                'SELECT files.hash, files.file FROM urls JOIN files ON urls.hash = files.hash WHERE urls.url = ?',
+                (url,)
+            ).fetchone()
+            if not row:
+                return None
+            (hash, file) = row
+            path = os.path.join(self.dir, file)
+            if not os.path.exists(path):
+                self.remove(hash)
+                self.db.commit()
+                return None
+            self.db.execute('UPDATE files SET atime = ? WHERE hash = ?', (time.time(), hash))
+            self.db.commit()
+            self.pinned.add(hash)
+            return path
+
+    def put(self, url: str, file: str) -> str:
+        """Move downloaded file into cache, return path of cached file"""
+        sha = hashlib.sha256()
+        with open(file, 'rb') as fh:
+            while chunk := fh.read(1 << 16):
+                sha.update(chunk)
+        hash = sha.hexdigest()
+        ext = imghdr.what(file) or os.path.splitext(file)[1][1:] or 'jpg'
+        name = f'{hash}.{ext}'
+        path = os.path.join(self.dir, name)
+        with self.lock:
+            if os.path.exists(path):
+                os.remove(file)
+            else:
+                shutil.move(file, path)
+            size = os.path.getsize(path)
+            cur = self.db.execute(
+                'INSERT OR IGNORE INTO files (hash, file, size, atime) VALUES (?, ?, ?, ?)',
+                (hash, name, size, time.time())
+            )
+            if cur.rowcount:
+                self.size += size
+            else:
+                self.db.execute('UPDATE files SET atime = ? WHERE hash = ?', (time.time(), hash))
+            self.db.execute('INSERT OR REPLACE INTO urls (url, hash) VALUES (?, ?)', (url, hash))
+            self.pinned.add(hash)
+            self.evict()
+            self.db.commit()
+        return path
+
+    def add_size(self, file: str, size: int):
+        """Count `size` bytes stored next to file (e.g. a thumbnail) towards it, if file is cached"""
+        if os.path.dirname(os.path.abspath(file)) != os.path.abspath(self.dir):
+            return
+        with self.lock:
+            cur = self.db.execute('UPDATE files SET size = size + ? WHERE file = ?', (size, os.path.basename(file)))
+            if cur.rowcount:
+                self.size += size
+                self.evict()
+            self.db.commit()
+
+    def unpin(self):
+        """Release files handed out so far, making them eligible for eviction"""
+        with self.lock:
+            self.pinned.clear()
+
+    def evict(self):
+        """Remove least recently used files until cache is within max size"""
+        if self.size <= self.max_size:
+            return
+        for (hash,) in self.db.execute('SELECT hash FROM files ORDER BY atime').fetchall():
+            if self.size <= self.max_size:
+                break
+            if hash not in self.pinned:
+                self.remove(hash)
+
+    def remove(self, hash: str):
+        """Remove file and its URLs from cache (caller holds lock and commits)"""
+        if row := self.db.execute('SELECT file, size FROM files WHERE hash = ?', (hash,)).fetchone():
+            path = os.path.join(self.dir, row[0])
+            for file in [path, *glob.glob(f'{glob.escape(path)}.thumb*.png')]:
+                try: os.remove(file)
+                except FileNotFoundError: pass
+            self.size -= row[1]
+        self.db.execute('DELETE FROM files WHERE hash = ?', (hash,))
+        self.db.execute('DELETE FROM urls WHERE hash = ?', (hash,))
+
+
+class SearchCache:
+    """
+    Cache of search results keyed by engine title and query, kept in memory
+    and optionally in an SQLite file, entries expire after `ttl` seconds.
+    Empty results are not cached (typically a block/rate limit rather than a
+    true lack of matches).
+    """
+    def __init__(self, file: str, ttl: float, logger: logging.Logger):
+        self.ttl = ttl
+        self.logger = logger
+        self.memory: dict[tuple[str, str], tuple[float, list[dict]]] = {}
+        self.lock = threading.Lock()
+        self.db = None
+        if file:
+            os.makedirs(os.path.dirname(file), exist_ok=True)
+            self.db = sqlite3.connect(file, check_same_thread=False)
+            self.db.execute(
+                'CREATE TABLE IF NOT EXISTS searches (engine TEXT NOT NULL, query TEXT NOT NULL, time REAL NOT NULL, matches TEXT NOT NULL, PRIMARY KEY (engine, query))'
+            )
+            self.db.execute('DELETE FROM searches WHERE time < ?', (time.time() - ttl,))
+            self.db.commit()
+
+    async def asearch(self, engine: Engine, query: str) -> list[Match]:
+        """Return cached matches for query or run and cache `engine.asearch`"""
+        if (matches := self.get(engine.title(), query)) is not None:
+            return matches
+        matches = await engine.asearch(query)
+        if matches:
+            self.put(engine.title(), query, matches)
+        return matches
+
+    def get(self, engine: str, query: str) -> list[Match]:
+        """Return cached matches or None if not cached/expired"""
+        key = (engine, query)
+        with self.lock:
+            entry = self.memory.get(key)
+            if not entry and self.db:
+                if row := self.db.execute(
+                    'SELECT time, matches FROM searches WHERE engine = ? AND query = ?', key
+                ).fetchone():
+                    entry = self.memory[key] = (row[0], json.loads(row[1]))
+        if not entry or entry[0] < time.time() - self.ttl:
+            return None
+        return [Match(**m) for m in entry[1]]
+
+    def put(self, engine: str, query: str, matches: list[Match]):
+        """Store matches (url, title and engine reported dimensions)"""
+        key = (engine, query)
+        entry = (time.time(), [
+            {'url': m.url, 'title': m.title, 'width': m._width, 'height': m._height}
+            for m in matches
+        ])
+        with self.lock:
+            self.memory[key] = entry
+            if self.db:
+                self.db.execute(
+                    'INSERT OR REPLACE INTO searches (engine, query, time, matches) VALUES (?, ?, ?, ?)',
+                    (*key, entry[0], json.dumps(entry[1]))
+                )
+                self.db.commit()
@@ -1,11 +1,10 @@
 import os
-from aqt.utils import Qt
 from anki.consts import *
 from .ankiutils import *
 
 # MISC CONSTANTS
 LIST_DLG_HMAX = 500
-TERM_ROLE = Qt.ItemDataRole.UserRole + 1
+ZOOM_CACHE_SIZE = 64 * 1024 * 1024
 
 # MISC TEXT/LABELS
 DEBUG_FILENAME = "s2n_error_log.txt"
@@ -14,14 +13,45 @@ ADDON_DIR = os.path.dirname(os.path.realpath(__file__))
 ENGINES_SUBDIR = "engines"
 DEBUG_FILE = os.path.join(ADDON_DIR, DEBUG_FILENAME)
 DEBUG_PROMPTED = os.path.join(ADDON_DIR, DEBUG_PROMPTEDNAME)
+USER_FILES_DIR = os.path.join(ADDON_DIR, "user_files") # Retained on add-on update
+CACHE_DIR = os.path.join(USER_FILES_DIR, "cache")
+SEARCH_CACHE_FILE = os.path.join(USER_FILES_DIR, "searches.db")
 
 # CONFIG KEYS
 CFG_THUMBH = "Thumbnail height"
 CFG_THUMBW = "Thumbnail width"
+CFG_THUMB_CACHE = "Thumbnail cache (MB)"
+CFG_PREFETCH = "Prefetch terms"
+CFG_PREFETCH_MEMORY = "Prefetch memory (MB)"
 CFG_TEMPLATE = "Query template"
 CFG_ENGINE = "Engine"
 CFG_IMGH = "Image height"
 CFG_IMGW = "Image width"
+CFG_IMG_RESIZE = "Resize images"
+CFG_IMG_FORMAT = "Image format"
+CFG_IMG_QUALITY = "Image quality"
+CFG_SEARCH_CONCURRENCY = "Search concurrency"
+CFG_SEARCH_RATE = "Search rate (per second)"
+CFG_SEARCH_RETRIES = "Search retries"
+CFG_DL_CONCURRENCY = "Download concurrency"
+CFG_DL_BATCH = "Curl batch download"
+CFG_DL_POOL = "Connections per host"
+CFG_DL_MAX_SIZE = "Max download size (MB)"
+CFG_CACHE_SIZE = "Cache size (MB)"
+CFG_SEARCH_TTL = "Search cache TTL (hours)"
+CFG_SEARCH_DISK = "Search cache on disk"
+CFG_DUP_DISTANCE = "Duplicate image distance"
+CFG_DUP_TERMS = "Duplicates across terms"
+CFG_FILTER = "Size filter"
+CFG_FILTER_MIN_W = "Min width"
+CFG_FILTER_MIN_H = "Min height"
+CFG_FILTER_MAX_W = "Max width"
+CFG_FILTER_MAX_H = "Max height"
+CFG_FILTER_MIN_ASPECT = "Min aspect ratio"
+CFG_FILTER_MAX_ASPECT = "Max aspect ratio"
+CFG_FILTER_MAX_PIXELS = "Max pixels"
+CFG_PROBE = "Probe dimensions"
+CFG_PROBE_SIZE = "Probe size (KB)"
 CFG_DEFAULT = "Google"
 CFG_CLOZE_TABLE = "Cloze <table> attributes"
 CFG_CLOZE_TD = "Cloze <td> attributes"
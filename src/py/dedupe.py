@@ -0,0 +1,70 @@
+"""Near-duplicate image detection using difference hashes (dHash)"""
+
+from aqt.qt import *
+from .thumbs import cached_thumbnail
+from .cache import DownloadCache
+try:
+    import numpy as np
+except ImportError: # Not bundled with all Anki versions, pure Python fallback
+    np = None
+
+HASH_W = 9
+HASH_H = 8
+
+def fingerprint(file: str, width: int, height: int, cache: DownloadCache = None) -> tuple[int, int]:
+    """
+    Return (64 bit dHash, pixel count) of image file, hash is None if the
+    file can not be decoded. The hash is computed from the file's width x
+    height thumbnail (see `cached_thumbnail`, generated if missing so the
+    original is decoded at most once, accounted to `cache`) shrunk to 9x8 grayscale, the pixel
+    count comes from the image header.
+    """
+    size = QImageReader(file).size()
+    pixels = max(0, size.width()) * max(0, size.height())
+    img = cached_thumbnail(file, width, height, cache)
+    if img.isNull():
+        return (None, pixels)
+    img = img.convertToFormat(QImage.Format.Format_Grayscale8).scaled(
+        HASH_W, HASH_H,
+        Qt.AspectRatioMode.IgnoreAspectRatio,
+        Qt.TransformationMode.SmoothTransformation
+    )
+    bpl = img.bytesPerLine()
+    ptr = img.constBits()
+    ptr.setsize(img.sizeInBytes())
+    data = bytes(ptr)
+    if np:
+        rows = np.frombuffer(data, dtype=np.uint8).reshape(HASH_H, bpl)[:, :HASH_W]
+        bits = (rows[:, 1:] > rows[:, :-1]).ravel()
+        return (int.from_bytes(np.packbits(bits).tobytes(), 'big'), pixels)
+    hash = 0
+    for y in range(HASH_H):
+        row = data[y * bpl:y * bpl + HASH_W]
+        for x in range(HASH_W - 1):
+            hash = hash << 1 | (row[x + 1] > row[x])
+    return (hash, pixels)
+
+
+def near(hashes: list[int], distance: int) -> list[list[bool]]:
+    """Matrix of whether hashes are within Hamming `distance` of each other"""
+    if np:
+        h = np.array(hashes, dtype=np.uint64)
+        x = (h[:, None] ^ h[None, :]).view(np.uint8).reshape(len(h), len(h), 8)
+        return (np.unpackbits(x, axis=2).sum(axis=2) <= distance).tolist()
+    return [[bin(a ^ b).count('1') <= distance for b in hashes] for a in hashes]
+
+
+def collapse(fingerprints: list[tuple[int, int]], distance: int, fixed: int = 0) -> list[int]:
+    """
+    Collapse near-duplicates (hashes within Hamming `distance`) keeping the
+    one with the most pixels. The first `fixed` fingerprints are always kept
+    (e.g. already shown), returns indices of the other ones that are kept.
+    """
+    valid = [i for i, (hash, _) in enumerate(fingerprints) if hash is not None]
+    matrix = near([fingerprints[i][0] for i in valid], distance) if valid else []
+    kept = []
+    for vi in sorted(range(len(valid)), key=lambda vi: -fingerprints[valid[vi]][1]):
+        if valid[vi] < fixed or not any(matrix[vi][ki] for ki in kept):
+            kept.append(vi)
+    kept = {valid[vi] for vi in kept}
+    return [i for i in range(fixed, len(fingerprints)) if i in kept or fingerprints[i][0] is None]
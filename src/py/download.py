@@ -0,0 +1,408 @@
+"""Image downloading (curl/requests) with a bounded worker pool"""
+
+import os, io, re, sys, shutil, tempfile, ssl, subprocess, threading, logging, requests
+from collections import OrderedDict
+from concurrent.futures import Future
+from requests.adapters import HTTPAdapter
+from urllib3.poolmanager import PoolManager
+from urllib3.util.ssl_ import create_urllib3_context
+from . import imghdr
+from .image_sz import get_image_size, get_image_metadata_from_bytesio
+from .cache import DownloadCache
+from .scheduler import PriorityExecutor, focus_priority
+
+if sys.platform == 'win32' or sys.platform == 'cygwin':
+    CURL = "curl.exe" if shutil.which('curl.exe') else None
+else:
+    CURL = "curl" if shutil.which('curl') else None
+
+def curl_version() -> tuple:
+    """Return installed `curl` version as tuple of ints or None"""
+    try:
+        out = subprocess.run([CURL, '--version'], stdout=subprocess.PIPE, universal_newlines=True).stdout
+        return tuple(int(v) for v in re.match(r'curl (\d+)\.(\d+)\.(\d+)', out).groups())
+    except:
+        return None
+
+CURL_VERSION = curl_version() if CURL else None
+# `--parallel` requires curl 7.66.0
+CURL_PARALLEL = bool(CURL_VERSION and CURL_VERSION >= (7, 66, 0))
+# `%{exitcode}` write out variable requires curl 7.75.0
+CURL_EXITCODE = bool(CURL_VERSION and CURL_VERSION >= (7, 75, 0))
+# `curl` exit code when `--max-filesize` is exceeded
+CURL_FILESIZE_EXCEEDED = 63
+# No. of batch `curl` processes that may run simultaneously
+CURL_BATCH_PROCESSES = 2
+# Chunk size of streamed `requests` downloads
+CHUNK_SIZE = 1 << 16
+
+USER_AGENT = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/103.0.5060.114 Safari/537.36'
+
+class TlsAdapter(HTTPAdapter):
+    """
+    Class to counter TLS fingerprinting
+    https://scrapfly.io/blog/how-to-avoid-web-scraping-blocking-tls/
+    """
+    def __init__(self, ssl_options=0, **kwargs):
+        self.ssl_options = ssl_options
+        super(TlsAdapter, self).__init__(**kwargs)
+
+    def init_poolmanager(self, *pool_args, **pool_kwargs):
+        # see "openssl ciphers" command for cipher names
+        ctx = create_urllib3_context(
+            ciphers="ECDHE-RSA-AES256-GCM-SHA384:ECDHE-ECDSA-AES256-GCM-SHA384", cert_reqs=ssl.CERT_REQUIRED,
+            options=self.ssl_options
+        )
+        self.poolmanager = PoolManager(*pool_args, ssl_context=ctx, **pool_kwargs)
+
+
+class Downloader:
+    """
+    Downloads URLs into a directory using `curl` if available, otherwise
+    `requests`, at most `concurrency` downloads in flight at any time (per
+    `curl` process in batch mode). Downloads are served from/stored in
+    `cache` if supplied. Queued downloads are prioritized by the distance of
+    their term (key) from the focused term, see `set_focus`. Each URL is
+    downloaded once per downloader (i.e. run), later requests for the same
+    URL share the first request's future. Downloads larger than `max_size`
+    bytes (0 for no limit) are aborted.
+    """
+    def __init__(self, dir: str, logger: logging.Logger, concurrency: int = 8, batch: bool = True, pool_size: int = 10, cache: DownloadCache = None, max_size: int = 0):
+        self.dir = dir
+        self.logger = logger
+        self.cache = cache
+        self.max_size = max_size
+        self.concurrency = max(1, concurrency)
+        self.batch = batch and CURL_PARALLEL
+        self.executor = PriorityExecutor(max_workers=self.concurrency, thread_name_prefix='S2N download')
+        self.batch_executor = PriorityExecutor(max_workers=CURL_BATCH_PROCESSES, thread_name_prefix='S2N curl')
+        self.procs: set[subprocess.Popen] = set()
+        self.cancelled = False
+        self.futures: dict[str, Future] = {}
+        self.lock = threading.Lock()
+        requests.packages.urllib3.disable_warnings(
+            requests.packages.urllib3.exceptions.InsecureRequestWarning
+        )
+        # One session for all `requests` downloads so that connections (and
+        # TLS sessions) to the same host are kept alive and reused
+        self.session = requests.Session()
+        self.session.headers = OrderedDict([
+            ('Upgrade-Insecure-Requests', '1'),
+            ('User-Agent', USER_AGENT),
+            ('Accept', 'text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,*/*;q=0.8'),
+            ('Accept-Encoding', 'gzip, deflate'),
+            ('Accept-Language', 'en-US,en;q=0.5')
+        ])
+        self.session.mount(
+            "https://",
+            TlsAdapter(
+                ssl.OP_NO_TLSv1 | ssl.OP_NO_TLSv1_1, # prio TLS1.2
+                pool_connections=max(self.concurrency, 10),
+                pool_maxsize=max(1, pool_size)
+            )
+        )
+        self.session.mount(
+            "http://",
+            HTTPAdapter(pool_connections=max(self.concurrency, 10), pool_maxsize=max(1, pool_size))
+        )
+
+    def submit_batch(self, urls: list[str], key: int = None) -> list[Future]:
+        """
+        Queue download of URLs, in a single `curl --parallel` process if
+        available, return list of futures resolving to tuple (status_code, file)
+        """
+        misses: list[str] = []
+        with self.lock:
+            for url in urls:
+                if url in self.futures:
+                    continue
+                if self.cache and (file := self.cache.get(url)):
+                    self.futures[url] = Future()
+                    self.futures[url].set_result((200, file))
+                else:
+                    self.futures[url] = None
+                    misses.append(url)
+            if misses:
+                if self.batch:
+                    downloads = [Future() for _ in misses]
+                    self.batch_executor.submit(key, self.curl_batch_download, misses, downloads)
+                else:
+                    downloads = [self.executor.submit(key, self.download, url) for url in misses]
+                for url, download in zip(misses, downloads):
+                    self.futures[url] = self.store(url, download) if self.cache else download
+            return [self.futures[url] for url in urls]
+
+    def submit_probes(self, urls: list[str], key: int = None, size: int = 16384) -> list[Future]:
+        """
+        Queue probes of the image header of URLs (first `size` bytes), return
+        list of futures resolving to (width, height) or None
+        """
+        return [self.executor.submit(key, self.probe, url, size) for url in urls]
+
+    def probe(self, url: str, size: int) -> tuple[int, int]:
+        """
+        Get image dimensions of URL from its first `size` bytes (HTTP Range
+        request, only `size` bytes are read if the server ignores the range),
+        return (width, height) or None if undetermined
+        """
+        if self.cache and (file := self.cache.get(url)):
+            return get_image_size(file)
+        try:
+            with self.session.get(
+                url = url,
+                headers = {'Range': f'bytes=0-{size - 1}'},
+                allow_redirects=True,
+                stream = True,
+                timeout = 15,
+                verify=False
+            ) as res: # Context releases (or closes unread) connection
+                if res.status_code not in (200, 206):
+                    return None
+                data = b''
+                for chunk in res.iter_content(chunk_size=size):
+                    data += chunk
+                    if len(data) >= size: break
+            data = data[:size]
+            meta = get_image_metadata_from_bytesio(io.BytesIO(data), len(data))
+            return (meta.width, meta.height) if meta.width > 0 and meta.height > 0 else None
+        except Exception as e:
+            self.logger.info(f"Probe failed|url: {url}|{e}")
+            return None
+
+    def store(self, url: str, download: Future) -> Future:
+        """Return future resolving to `download` result with file moved into cache"""
+        future = Future()
+        def done(download: Future):
+            try:
+                (status_code, file) = download.result()
+                if status_code == 200 and file:
+                    file = self.cache.put(url, file)
+                future.set_result((status_code, file))
+            except Exception as e:
+                future.set_exception(e)
+        download.add_done_callback(done)
+        return future
+
+    def set_focus(self, key: int):
+        """Download queued URLs for key (term) and the ones after it first"""
+        self.executor.set_priority(focus_priority(key))
+        self.batch_executor.set_priority(focus_priority(key))
+
+    def shutdown(self, cancel: bool = False):
+        """
+        Shut down worker pools, optionally cancelling queued downloads and
+        terminating running `curl` processes, returns once all workers have
+        finished (i.e. nothing writes to `dir` any more)
+        """
+        self.executor.shutdown(cancel, wait=False)
+        self.batch_executor.shutdown(cancel, wait=False)
+        if cancel:
+            with self.lock:
+                self.cancelled = True
+                for proc in self.procs: proc.terminate()
+        self.executor.shutdown(cancel)
+        self.batch_executor.shutdown(cancel)
+        self.session.close()
+
+    def download(self, url: str):
+        """Download URL, return tuple (status_code, file)"""
+        if CURL: return self.curl_download(url)
+        return self.requests_download(url)
+
+    def curl_download(self, url: str):
+        """Attempt to download URL using `curl`, return tuple (status_code, file)"""
+        tmp = tempfile.NamedTemporaryFile(
+            mode='wb',
+            suffix='.jpg',
+            dir=self.dir,
+            delete=False
+        )
+        tmp.close()
+        proc = self.popen(
+            [
+                CURL,
+                '-H', f'User-Agent: {USER_AGENT}, Accept-Encoding:gzip,deflate',
+                '--connect-timeout', '5',
+                '-o', tmp.name,
+                '-L',                   # follow redirect
+                '-s',                   # silent
+                '-w', '%{http_code}\t%{content_type}', # write final status_code and type to stdout
+                *(['--max-filesize', str(self.max_size)] if self.max_size else []),
+                '-X', 'GET', url
+            ],
+            stdout=subprocess.PIPE,
+            universal_newlines=True
+        )
+        try:
+            (out, _) = proc.communicate()
+        finally:
+            with self.lock: self.procs.discard(proc)
+        (code, _, type) = out.strip().partition('\t')
+        try:
+            code = int(code)
+        except:
+            code = 400
+        return self.check_size(url, code, tmp.name, proc.returncode, type)
+
+    def popen(self, args: list[str], **kwargs) -> subprocess.Popen:
+        """Start `curl` process, tracked so that `shutdown` can terminate it"""
+        proc = subprocess.Popen(args, **kwargs)
+        with self.lock:
+            self.procs.add(proc)
+            if self.cancelled: proc.terminate()
+        return proc
+
+    def check_size(self, url: str, code: int, file: str, exitcode: int = 0, type: str = ''):
+        """
+        Return tuple (status_code, file) for a `curl` download, 413 if it was
+        aborted or is larger than `max_size` (`curl` can only abort transfers
+        without Content-Length from 8.4.0), 415 if it is not an image (sniffed
+        like `requests_download`, falling back on Content-Type `type`)
+        """
+        if self.max_size and (
+            exitcode == CURL_FILESIZE_EXCEEDED or
+            code == 200 and os.path.exists(file) and os.path.getsize(file) > self.max_size
+        ):
+            self.logger.info(f"Too large|url: {url}")
+            try: os.remove(file)
+            except FileNotFoundError: pass
+            return (413, None)
+        if code == 200:
+            try:
+                with open(file, 'rb') as fh: head = fh.read(32)
+            except OSError:
+                head = b''
+            if not imghdr.what(file=None, h=head) and not type.startswith('image/'):
+                self.logger.info(f"Not an image|url: {url}")
+                try: os.remove(file)
+                except FileNotFoundError: pass
+                return (415, None)
+        return (code, file)
+
+    def curl_batch_download(self, urls: list[str], futures: list[Future]):
+        """
+        Download URLs with one `curl --parallel` process driven by a config
+        file, resolving each future as `curl` reports the transfer done
+        """
+        def quote(s: str):
+            return '"' + s.replace('\\', '\\\\').replace('"', '\\"') + '"'
+
+        outputs = {}
+        cfg = None
+        try:
+            with tempfile.NamedTemporaryFile(
+                mode='w',
+                suffix='.cfg',
+                dir=self.dir,
+                delete=False,
+                encoding='utf-8'
+            ) as cfg:
+                if self.max_size:
+                    cfg.write(f'max-filesize = {self.max_size}\n')
+                for url, future in zip(urls, futures):
+                    (fd, file) = tempfile.mkstemp(suffix='.jpg', dir=self.dir)
+                    os.close(fd)
+                    outputs[os.path.normcase(os.path.abspath(file))] = (future, file, url)
+                    cfg.write(f'url = {quote(url)}\noutput = {quote(file)}\n')
+            proc = self.popen(
+                [
+                    CURL,
+                    '-H', f'User-Agent: {USER_AGENT}, Accept-Encoding:gzip,deflate',
+                    '--connect-timeout', '5',
+                    '--parallel',
+                    '--parallel-max', str(self.concurrency),
+                    '-L',                   # follow redirect
+                    '-s',                   # silent
+                    # write status_code, exit code (if supported), type and file per transfer
+                    '-w', f'%{{http_code}}\t{"%{exitcode}" if CURL_EXITCODE else "0"}\t%{{content_type}}\t%{{filename_effective}}\n',
+                    '-K', cfg.name
+                ],
+                stdout=subprocess.PIPE,
+                stderr=subprocess.DEVNULL,  # --parallel progress meter ignores -s
+                universal_newlines=True,
+                encoding='utf-8'
+            )
+            try:
+                for line in proc.stdout:
+                    if len(parts := line.rstrip('\n').split('\t', 3)) != 4: continue
+                    (code, exitcode, type, file) = parts
+                    if entry := outputs.pop(os.path.normcase(os.path.abspath(file)), None):
+                        try: code = int(code)
+                        except: code = 400
+                        try: exitcode = int(exitcode)
+                        except: exitcode = 0
+                        entry[0].set_result(self.check_size(entry[2], code, entry[1], exitcode, type))
+                proc.wait()
+            finally:
+                with self.lock: self.procs.discard(proc)
+        except Exception as e:
+            self.logger.warning(f"Batch download failed|{e}")
+            # Futures not yet resolved (or not even set up) fail with the error
+            for future in futures:
+                if not future.done(): future.set_exception(e)
+            outputs.clear()
+        finally:
+            if cfg:
+                try: os.remove(cfg.name)
+                except FileNotFoundError: pass
+        for (future, file, _) in outputs.values(): # Not reported by curl
+            future.set_result((400, file))
+
+    def requests_download(self, url: str):
+        """
+        Attempt to download URL with `requests`, streaming it to disk (memory
+        use bounded by the chunk size). The image type is sniffed from the
+        first chunk, non-images (415) and bodies larger than `max_size` (413)
+        are aborted. Return tuple (status_code, file)
+        """
+        with self.session.get(
+            url = url,
+            allow_redirects=True,
+            stream = True,
+            timeout = 15,
+            verify=False
+        ) as res: # Context releases connection back to pool (closes it if aborted)
+            if res.status_code != 200:
+                self.logger.info(f"Non-200 return|url: {url}")
+                return (res.status_code, None)
+            try: length = int(res.headers.get('Content-Length', 0))
+            except ValueError: length = 0
+            if self.max_size and length > self.max_size:
+                self.logger.info(f"Too large|url: {url}")
+                return (413, None)
+
+            chunks = res.iter_content(chunk_size=CHUNK_SIZE)
+            head = b''
+            for chunk in chunks:
+                head += chunk
+                if len(head) >= 32: break # Enough to sniff type
+            if e := imghdr.what(file=None, h=head):
+                ext = f".{e}"
+            elif res.headers.get('Content-Type', '').startswith('image/'):
+                self.logger.info(f"Unable to detect image type for {url}")
+                ext = ".jpg"
+            else:
+                self.logger.info(f"Not an image|url: {url}")
+                return (415, None)
+
+            size = len(head)
+            with tempfile.NamedTemporaryFile(
+                mode='wb',
+                suffix=ext,
+                dir=self.dir,
+                delete=False
+            ) as tmp:
+                tmp.write(head)
+                for chunk in chunks:
+                    if self.cancelled: break
+                    size += len(chunk)
+                    if self.max_size and size > self.max_size: break
+                    tmp.write(chunk)
+            if self.cancelled: # Aborted by shutdown(cancel=True)
+                os.remove(tmp.name)
+                return (0, None)
+            if self.max_size and size > self.max_size:
+                self.logger.info(f"Too large|url: {url}")
+                os.remove(tmp.name)
+                return (413, None)
+            return (res.status_code, tmp.name)
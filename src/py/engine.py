@@ -2,7 +2,7 @@
 
 # https://mwax911.medium.com/building-a-plugin-architecture-with-python-7b4ab39ad4fc
 
-import os, re
+import os, re, asyncio, requests
 from abc import ABC, abstractmethod, abstractstaticmethod
 from logging import Logger
 from dataclasses import dataclass, field
@@ -10,6 +10,7 @@ from importlib import import_module, reload
 from glob import iglob
 from .image_sz import *
 from .consts import *
+from .ratelimit import REQUEST_TIMEOUT
 try:
     from aqt import QApplication
 except:
@@ -44,14 +45,14 @@ class Match:
     file: str = None
     selected: bool = False
 
+    @property
+    def reported_size(self) -> tuple[int, int]:
+        """Engine reported (width, height), None where unknown (does not probe file)"""
+        return (self._width, self._height)
+
 @dataclass
 class Term:
-    """Container class for one search term and its matches, deletes downloaded files on destruction"""    
-    def __del__(self):
-        for match in self.matches if self.matches else []:
-            try: os.remove(match['file'])
-            except: pass
-
+    """Container class for one search term and its matches (downloaded files are owned by the download cache/temporary directory)"""
     term: str = None
     #_term: str = field(init=True, repr=False)
     #@property
@@ -64,7 +65,8 @@ class Term:
     _query: str = None #field(init=False, repr=False)
     def query(self, template: str):
         """Return query for search term from template"""
-        if self._query == None:
+        if self._query == None or template != self.template:
+            self.template = template
             # Replace all %0 with complete term
             q = re.sub(r"(?<!%)%0(?!\d)", self.term, template)
             # Parse term parts and replace corresponding %\d's in query
@@ -85,7 +87,13 @@ class Engine(ABC):
         def legend(self) -> str: text to be inserted under query box
         def tooltip(self) -> str: text/HTML to be used as tooltip for the query box
         def search(self, hquery: str) -> [Match]
+    and optionally, for engines with native async I/O:
+        async def asearch(self, query: str) -> [Match]
+    Use `self.get` rather than `requests.get` for search requests to be rate
+    limited/backed off along with all other searches in the run.
     """
+    limiter = None # RateLimiter set by pipeline for the duration of a run
+
     @abstractmethod
     def __init__(self, logger: Logger, config: any):
         pass
@@ -105,6 +113,22 @@ class Engine(ABC):
     def search(self, query: str) -> list[Match]:
         """Return array of Match for query."""
         return None
+    def get(self, url: str, valid=None, **kwargs) -> requests.Response:
+        """
+        HTTP GET through the run's rate limiter, `valid(response)` may reject
+        (e.g. empty/blocked) responses to retry them with backoff.
+        """
+        kwargs.setdefault('timeout', REQUEST_TIMEOUT)
+        if self.limiter:
+            return self.limiter.get(self.title(), url, valid, **kwargs)
+        return requests.get(url, **kwargs)
+
+    async def asearch(self, query: str) -> list[Match]:
+        """
+        Return array of Match for query, asynchronous variant. Default runs the
+        (blocking) `search` in the event loop's default executor.
+        """
+        return await asyncio.get_running_loop().run_in_executor(None, self.search, query)
 
 def load_engines():
     """Load engines, return dict of title: engine"""
@@ -8,7 +8,7 @@ seem to work, only these: [exact term]", +/-[term], site:[url]
 Additional modifier maxn:\d implemented
 """
 
-import requests, re, json, time
+import re, json
 from logging import Logger
 from ..engine import *
 _URL = 'https://duckduckgo.com/'
@@ -19,7 +19,7 @@ class DDG(Engine):
     def title():
         return "DuckDuckGo (API)"
 
-    def __init__(self, logger: Logger):
+    def __init__(self, logger: Logger, config: dict):
         self.logger = logger
 
     def legend(self):
@@ -79,18 +79,19 @@ class DDG(Engine):
         }
     
         # Get vqd token for the search
-        res = requests.get(
+        res = self.get(
             f'{_URL}/?va=f&t=hg&q={query}&iax=images&ia=images',
+            valid=lambda res: 'vqd=' in res.text,
             headers=headers
         )
-        print(f'token res: {res.text}')
+        self.logger.debug(f'token res: {res.text if res else res}')
         if res and (m := re.match(
             r'.*?vqd=([\'"]?)(.*?)(?:[\'"&].*|$)',
             res.text
         )):
             vqd = m.group(2)
         else:
-            print("no vqd matched")
+            self.logger.debug("no vqd matched")
             return None
 
         params = {
@@ -105,18 +106,18 @@ class DDG(Engine):
             'v7exp': 'a' # ?
         }
         request = _URL + "i.js"
+        def is_json(res):
+            try: json.loads(res.text)
+            except ValueError: return False
+            return True
+
         while True:
-            data = None
-            for _ in range(3):
-                try:
-                    print(f'query: {request}, headers: {headers}, params: {params}')
-                    res = requests.get(url=request, headers=headers, params=params)
-                    print(f'res: {res}')
-                    data = json.loads(res.text)
-                    break
-                except ValueError as e:
-                    time.sleep(1)
-            if data is None:
+            self.logger.debug(f'query: {request}, headers: {headers}, params: {params}')
+            res = self.get(url=request, valid=is_json, headers=headers, params=params)
+            self.logger.debug(f'res: {res}')
+            try:
+                data = json.loads(res.text)
+            except ValueError:
                 return None
             for item in data['results']:
                 result.append(Match(
@@ -76,8 +76,9 @@ class Google(Engine):
             else:
                 query = m.group(1).strip() if m.group(1) else m.group(3).strip()
 
-        html = requests.get(
+        html = self.get(
             url = "https://www.google.com/search",
+            valid = lambda res: 'AF_initDataCallback' in res.text, # Blocked/consent page otherwise
             params = {
                 "q": query,          # search query
                 "tbm": "isch",                  # image results
@@ -0,0 +1,67 @@
+"""Filtering of matches on engine reported dimensions"""
+
+from dataclasses import dataclass
+from .engine import Match
+try:
+    import numpy as np
+except ImportError: # Not bundled with all Anki versions, pure Python fallback
+    np = None
+
+@dataclass
+class SizeFilter:
+    """
+    Rules for engine reported image dimensions, 0 means no limit. Matches
+    with unknown dimensions always pass.
+    """
+    min_width: int = 0
+    min_height: int = 0
+    max_width: int = 0
+    max_height: int = 0
+    min_aspect: float = 0 # width/height
+    max_aspect: float = 0
+    max_pixels: int = 0
+
+    def active(self) -> bool:
+        return any((self.min_width, self.min_height, self.max_width, self.max_height, self.min_aspect, self.max_aspect, self.max_pixels))
+
+    def mask(self, sizes: list[tuple[int, int]]) -> list[bool]:
+        """Return whether each (width, height) passes the rules"""
+        if np:
+            (w, h) = np.array(
+                [(w or 0, h or 0) for (w, h) in sizes], dtype=np.float64
+            ).reshape(-1, 2).T
+            known = (w > 0) & (h > 0)
+            ok = np.ones(len(sizes), dtype=bool)
+            if self.min_width: ok &= w >= self.min_width
+            if self.min_height: ok &= h >= self.min_height
+            if self.max_width: ok &= w <= self.max_width
+            if self.max_height: ok &= h <= self.max_height
+            if self.max_pixels: ok &= w * h <= self.max_pixels
+            if self.min_aspect or self.max_aspect:
+                aspect = np.divide(w, h, out=np.zeros_like(w), where=known)
+                if self.min_aspect: ok &= aspect >= self.min_aspect
+                if self.max_aspect: ok &= aspect <= self.max_aspect
+            return (ok | ~known).tolist()
+        return [self.passes(w or 0, h or 0) for (w, h) in sizes]
+
+    def passes(self, w: int, h: int) -> bool:
+        """Whether single image dimensions pass the rules"""
+        return (
+            w <= 0 or h <= 0 or
+            (not self.min_width or w >= self.min_width) and
+            (not self.min_height or h >= self.min_height) and
+            (not self.max_width or w <= self.max_width) and
+            (not self.max_height or h <= self.max_height) and
+            (not self.max_pixels or w * h <= self.max_pixels) and
+            (not self.min_aspect or w / h >= self.min_aspect) and
+            (not self.max_aspect or w / h <= self.max_aspect)
+        )
+
+    def apply(self, matches: list[Match]) -> tuple[list[Match], list[Match]]:
+        """Split matches into (passing, rejected)"""
+        if not self.active() or not matches:
+            return (matches, [])
+        (passing, rejected) = ([], [])
+        for match, ok in zip(matches, self.mask([match.reported_size for match in matches])):
+            (passing if ok else rejected).append(match)
+        return (passing, rejected)
@@ -0,0 +1,71 @@
+"""Item model for the image list view"""
+
+from aqt.qt import *
+from .engine import Match
+from .thumbs import ThumbnailCache
+
+class MatchListModel(QAbstractListModel):
+    """
+    List model backed directly by a term's matches (those with a downloaded
+    file). Icons come from the thumbnail cache, rows whose thumbnail is not
+    ready yet show a blank placeholder and are updated once it is generated.
+    Connect the view's `selectionChanged` to `selection_changed` to keep
+    `Match.selected` in sync with the view.
+    """
+    def __init__(self, parent: QObject, thumbs: ThumbnailCache):
+        super().__init__(parent)
+        self.thumbs = thumbs
+        self.matches: list[Match] = []
+        self.rows: dict[str, list[int]] = {}
+        self.icons: dict[int, QIcon] = {}
+        pixmap = QPixmap(thumbs.width, thumbs.height)
+        pixmap.fill(Qt.GlobalColor.transparent)
+        self.placeholder = QIcon(pixmap)
+        thumbs.ready.connect(self.thumbnail_ready)
+
+    def set_matches(self, matches: list[Match]):
+        """Replace shown matches"""
+        self.beginResetModel()
+        self.matches = [m for m in matches or [] if m.file]
+        self.rows = {}
+        for row, match in enumerate(self.matches):
+            self.rows.setdefault(match.file, []).append(row)
+        self.icons = {}
+        self.endResetModel()
+
+    def match_at(self, row: int) -> Match:
+        """Return match at row or None"""
+        return self.matches[row] if 0 <= row < len(self.matches) else None
+
+    def selection_changed(self, selected: QItemSelection, deselected: QItemSelection):
+        """Write view selection changes to the matches' `selected`"""
+        for (selection, state) in ((deselected, False), (selected, True)):
+            for index in selection.indexes():
+                if match := self.match_at(index.row()):
+                    match.selected = state
+
+    def thumbnail_ready(self, file: str):
+        """Update rows showing file"""
+        for row in self.rows.get(file, []):
+            self.icons.pop(row, None)
+            self.dataChanged.emit(self.index(row), self.index(row), [Qt.ItemDataRole.DecorationRole])
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.matches)
+
+    def data(self, index: QModelIndex, role=Qt.ItemDataRole.DisplayRole):
+        if not index.isValid() or not (match := self.match_at(index.row())):
+            return None
+        if role == Qt.ItemDataRole.DisplayRole:
+            return match.title
+        if role == Qt.ItemDataRole.ToolTipRole:
+            return match.url
+        if role == Qt.ItemDataRole.DecorationRole:
+            if icon := self.icons.get(index.row()):
+                return icon
+            if img := self.thumbs.get(match.file):
+                icon = self.icons[index.row()] = QIcon(QPixmap.fromImage(img))
+                return icon
+            self.thumbs.request(match.file, 2) # Visible rows before prefetched and background ones
+            return self.placeholder
+        return None
@@ -99,7 +99,7 @@ class Ui_mainwindow(object):
         self.label_2.setFont(font)
         self.label_2.setObjectName("label_2")
         self.verticalLayout_4.addWidget(self.label_2)
-        self.image_lv = QtWidgets.QListWidget(self.right)
+        self.image_lv = QtWidgets.QListView(self.right)
         self.image_lv.setEnabled(False)
         self.image_lv.setContextMenuPolicy(QtCore.Qt.CustomContextMenu)
         self.image_lv.setSelectionMode(QtWidgets.QAbstractItemView.MultiSelection)
@@ -108,7 +108,7 @@ class Ui_mainwindow(object):
         self.image_lv.setTextElideMode(QtCore.Qt.ElideNone)
         self.image_lv.setResizeMode(QtWidgets.QListView.Adjust)
         self.image_lv.setViewMode(QtWidgets.QListView.IconMode)
-        self.image_lv.setUniformItemSizes(False)
+        self.image_lv.setUniformItemSizes(True)
         self.image_lv.setWordWrap(True)
         self.image_lv.setObjectName("image_lv")
         self.verticalLayout_4.addWidget(self.image_lv)
@@ -97,7 +97,7 @@ class Ui_mainwindow(object):
         self.label_2.setFont(font)
         self.label_2.setObjectName("label_2")
         self.verticalLayout_4.addWidget(self.label_2)
-        self.image_lv = QtWidgets.QListWidget(parent=self.right)
+        self.image_lv = QtWidgets.QListView(parent=self.right)
         self.image_lv.setEnabled(False)
         self.image_lv.setContextMenuPolicy(QtCore.Qt.ContextMenuPolicy.CustomContextMenu)
         self.image_lv.setSelectionMode(QtWidgets.QAbstractItemView.SelectionMode.MultiSelection)
@@ -106,7 +106,7 @@ class Ui_mainwindow(object):
         self.image_lv.setTextElideMode(QtCore.Qt.TextElideMode.ElideNone)
         self.image_lv.setResizeMode(QtWidgets.QListView.ResizeMode.Adjust)
         self.image_lv.setViewMode(QtWidgets.QListView.ViewMode.IconMode)
-        self.image_lv.setUniformItemSizes(False)
+        self.image_lv.setUniformItemSizes(True)
         self.image_lv.setWordWrap(True)
         self.image_lv.setObjectName("image_lv")
         self.verticalLayout_4.addWidget(self.image_lv)
@@ -0,0 +1,102 @@
+"""Preparation of images before they are added to the collection media"""
+
+import os, hashlib, logging
+from dataclasses import dataclass
+from concurrent.futures import ThreadPoolExecutor
+from aqt.qt import *
+
+FORMATS = {'jpg': 'JPEG', 'jpeg': 'JPEG', 'png': 'PNG', 'webp': 'WEBP'}
+
+@dataclass
+class MediaFile:
+    """Image prepared for adding to media: file to add, content hash and dimensions"""
+    file: str
+    hash: str
+    width: int
+    height: int
+
+
+def resize_image(file: str, dir: str, width: int, height: int, format: str, quality: int) -> str:
+    """
+    Downscale image file to fit width x height (negative for no limit) and/or
+    recompress it to format (extension, empty to keep the format of the
+    content, downloads are not necessarily named after it) and quality, writing
+    the result to dir. Returns path of the new file, or the original file when
+    neither is needed, the image is animated or the result would be larger.
+    """
+    reader = QImageReader(file)
+    reader.setAutoTransform(True)
+    size = reader.size()
+    if not size.isValid() or (reader.supportsAnimation() and reader.imageCount() > 1):
+        return file
+    target = QSize(
+        width if width > 0 else size.width(),
+        height if height > 0 else size.height()
+    )
+    target = size.scaled(target, Qt.AspectRatioMode.KeepAspectRatio) if size.width() > target.width() or size.height() > target.height() else size
+    (base, ext) = os.path.splitext(os.path.basename(file))
+    source = bytes(reader.format()).decode().lower() or ext[1:].lower()
+    format = (format or source).lower()
+    if target == size and FORMATS.get(format, format) == FORMATS.get(source, source):
+        return file
+    if format not in FORMATS:
+        return file
+    if target != size:
+        reader.setScaledSize(target)
+    img = reader.read()
+    if img.isNull():
+        return file
+    if FORMATS[format] == 'JPEG' and img.hasAlphaChannel(): # JPEG has no alpha, flatten on white
+        flat = QImage(img.size(), QImage.Format.Format_RGB32)
+        flat.fill(Qt.GlobalColor.white)
+        painter = QPainter(flat)
+        painter.drawImage(0, 0, img)
+        painter.end()
+        img = flat
+    path = os.path.join(dir, f'{base}.{format}')
+    writer = QImageWriter(path, FORMATS[format].encode())
+    writer.setQuality(quality)
+    if not writer.write(img):
+        return file
+    if target == size and os.path.getsize(path) >= os.path.getsize(file):
+        os.remove(path)
+        return file
+    return path
+
+
+def prepare_image(file: str, dir: str, width: int, height: int, resize: bool, format: str, quality: int) -> MediaFile:
+    """Resize/recompress (if `resize`), hash and get dimensions of image file"""
+    if resize:
+        file = resize_image(file, dir, width, height, format, quality)
+    sha = hashlib.sha256()
+    with open(file, 'rb') as fh:
+        while chunk := fh.read(1 << 16):
+            sha.update(chunk)
+    reader = QImageReader(file)
+    reader.setAutoTransform(True)
+    size = reader.size()
+    if size.isValid() and reader.transformation() & QImageIOHandler.Transformation.TransformationRotate90:
+        size.transpose()
+    return MediaFile(file, sha.hexdigest(), max(0, size.width()), max(0, size.height()))
+
+
+def prepare_media(files: list[str], dir: str, width: int, height: int, resize: bool, format: str, quality: int, logger: logging.Logger) -> dict[str, MediaFile]:
+    """
+    Prepare image files in parallel (QImage decoding/encoding and hashing
+    release the GIL), return dict of original file -> `MediaFile` (files that
+    can not be read are left out)
+    """
+    def prepare(file: str) -> MediaFile:
+        try:
+            return prepare_image(file, dir, width, height, resize, format, quality)
+        except Exception as e:
+            logger.warning(f'Prepare `{file}`: {e}')
+            return None
+
+    os.makedirs(dir, exist_ok=True)
+    with ThreadPoolExecutor(thread_name_prefix='S2N media') as executor:
+        return {
+            file: media
+            for file, media in zip(files, executor.map(prepare, files))
+            if media
+        }
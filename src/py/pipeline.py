@@ -0,0 +1,234 @@
+"""Background search/download pipeline"""
+
+import asyncio, tempfile, logging, threading
+from concurrent.futures import ThreadPoolExecutor
+from aqt.qt import *
+from .engine import *
+from .download import Downloader
+from .cache import DownloadCache, SearchCache
+from .ratelimit import RateLimiter
+from .thumbs import ThumbnailCache
+from .filters import SizeFilter
+from . import dedupe
+from .ankiutils import t
+
+class QueryPipeline(QThread):
+    """
+    Runs the searches for a list of queries on an asyncio event loop in a
+    background thread, at most `search_concurrency` searches in flight and
+    search requests rate limited to `search_rate` per second and host (with
+    backoff on errors, see `RateLimiter`). The downloads of each term's
+    matches are queued as soon as its search returns so that searching
+    overlaps downloading. Matches rejected by `size_filter` are not
+    downloaded, the filter uses the engine reported dimensions or, with
+    `probe` 'missing'/'all', the dimensions read from the first `probe_size`
+    bytes of the image. Downloads larger than `max_size` bytes (0 for no
+    limit) are aborted. Thumbnails (if `thumbs` given) are generated as each
+    download finishes. Near-duplicate images (dHash within `dup_distance`,
+    negative to disable) are collapsed per term, or with `dup_terms` also
+    against the images kept for earlier terms (lower index), keeping the
+    highest resolution. Files not stored in the
+    download cache are written to a temporary directory owned by the
+    pipeline, removed by `cleanup` (once the thread has finished, `dispose`
+    does so without blocking). Emits:
+        progress(done, total, text): items (searches + downloads) done/known
+        term_done(index, matches, skipped): all downloads of term finished
+        failed(msg): search engine failure, pipeline stops
+    """
+    progress = pyqtSignal(int, int, str)
+    term_done = pyqtSignal(int, object, object)
+    failed = pyqtSignal(str)
+
+    def __init__(self, parent: QObject, engine: Engine, queries: list[str], logger: logging.Logger, *, concurrency: int, batch: bool, pool_size: int, cache: DownloadCache, search_cache: SearchCache, search_concurrency: int, search_rate: float, search_retries: int, thumbs: ThumbnailCache = None, dup_distance: int = -1, dup_terms: bool = False, size_filter: SizeFilter = None, probe: str = 'off', probe_size: int = 16384, max_size: int = 0):
+        super().__init__(parent)
+        self.engine = engine
+        self.queries = queries
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.dir = self.tmp_dir.name
+        self.logger = logger
+        self.concurrency = concurrency
+        self.batch = batch
+        self.pool_size = pool_size
+        self.cache = cache
+        self.search_cache = search_cache
+        self.search_concurrency = max(1, search_concurrency)
+        self.search_rate = search_rate
+        self.search_retries = search_retries
+        self.thumbs = thumbs
+        self.dup_distance = dup_distance
+        self.dup_terms = dup_terms
+        self.size_filter = size_filter
+        self.probe = probe
+        self.probe_size = probe_size
+        self.max_size = max_size
+        self.limiter = RateLimiter(search_rate, self.search_concurrency, search_retries, logger)
+        self.fingerprints: dict[int, list[tuple[int, int]]] = {} # Kept images of finished terms by index (dup_terms)
+        self.lock = threading.Lock()
+        self.cancelled = False
+        self.focus = 0
+        self.downloader = None
+        self.done = 0
+        self.total = len(queries)
+
+    def cancel(self):
+        """Request pipeline to stop, queued searches and downloads are dropped"""
+        self.cancelled = True
+        self.limiter.cancel()
+
+    def cleanup(self):
+        """Remove the run's temporary files, the thread must have finished"""
+        try:
+            self.tmp_dir.cleanup()
+        except OSError as e:
+            self.logger.warning(f'Unable to remove `{self.dir}`: {e}')
+
+    def dispose(self):
+        """Clean up and delete pipeline once the thread has finished, without waiting for it"""
+        self.finished.connect(self.release)
+        if not self.isRunning(): # Finished before connecting (or never started)
+            self.release()
+
+    def release(self):
+        self.wait() # Returns at once, thread is finishing or finished
+        self.cleanup()
+        self.deleteLater()
+
+    def set_focus(self, index: int):
+        """Prioritize downloads of term at index and the ones following it"""
+        self.focus = index
+        if self.downloader:
+            self.downloader.set_focus(index)
+
+    def run(self):
+        asyncio.run(self.arun())
+
+    async def arun(self):
+        """Run all terms concurrently, polling for cancellation"""
+        loop = asyncio.get_running_loop()
+        # Legacy (sync) engines run in the default executor
+        loop.set_default_executor(ThreadPoolExecutor(
+            max_workers=self.search_concurrency,
+            thread_name_prefix='S2N search'
+        ))
+        self.semaphore = asyncio.Semaphore(self.search_concurrency)
+        self.engine.limiter = self.limiter
+        downloader = Downloader(self.dir, self.logger, self.concurrency, self.batch, self.pool_size, self.cache, self.max_size)
+        downloader.set_focus(self.focus)
+        self.downloader = downloader
+        tasks = {asyncio.create_task(self.run_term(i, query)): (i, query) for i, query in enumerate(self.queries)}
+        pending = set(tasks)
+        while pending:
+            (done, pending) = await asyncio.wait(pending, timeout=0.1)
+            for task in done: # Report terms failed outside the search as skipped
+                if not task.cancelled() and (e := task.exception()):
+                    (index, query) = tasks[task]
+                    self.logger.warning(f'Exception `{query}`: {e}')
+                    self.term_done.emit(index, [], [f'{query} ({e})'])
+            if self.cancelled:
+                for task in pending: task.cancel()
+                await asyncio.gather(*pending, return_exceptions=True)
+                break
+        self.downloader.shutdown(cancel=self.cancelled)
+        if self.engine.limiter is self.limiter: # Not replaced by a newer run
+            self.engine.limiter = None
+
+    def step(self, text: str):
+        """Count one finished item and report progress"""
+        self.done += 1
+        self.progress.emit(self.done, self.total, text)
+
+    async def run_term(self, index: int, query: str):
+        """Search for term, then download and report its matches"""
+        async with self.semaphore:
+            if self.cancelled: return
+            self.progress.emit(self.done, self.total, t('Searching %(query)s...') % {'query': query})
+            try:
+                if self.search_cache:
+                    matches = await self.search_cache.asearch(self.engine, query)
+                else:
+                    matches = await self.engine.asearch(query)
+            except Exception as e:
+                self.logger.warning(f'Exception `{query}`: {e}')
+                matches = None
+        if self.cancelled: return
+        if matches is None:
+            msg = t('%(engine)s search for "%(query)s" returned None, search engine plugin broken?') % {'engine': self.engine.title(), 'query': query}
+            self.logger.warning(msg)
+            self.failed.emit(msg)
+            self.cancel()
+            return
+        if self.probe in ('missing', 'all'):
+            await self.probe_sizes(index, matches)
+        if self.size_filter:
+            (matches, rejected) = self.size_filter.apply(matches)
+            if rejected:
+                self.logger.info(f'Filtered {len(rejected)} image(s) on size `{query}`')
+        self.total += len(matches)
+        self.step(t('Searching %(query)s...') % {'query': query})
+
+        futures = [
+            asyncio.wrap_future(future)
+            for future in self.downloader.submit_batch([match.url for match in matches], index)
+        ]
+        for future, match in zip(futures, matches):
+            future.add_done_callback(lambda future, url=match.url: self.downloaded(future, url))
+        results = await asyncio.gather(*futures, return_exceptions=True)
+        (downloaded, skipped) = self.split_results(matches, results)
+        if self.dup_distance >= 0 and downloaded:
+            downloaded = await asyncio.get_running_loop().run_in_executor(None, self.collapse, index, downloaded)
+        self.term_done.emit(index, downloaded, skipped)
+
+    async def probe_sizes(self, index: int, matches: list[Match]):
+        """Set dimensions of matches (missing or all) from the image headers"""
+        targets = [m for m in matches if self.probe == 'all' or not all(m.reported_size)]
+        if not targets: return
+        results = await asyncio.gather(*[
+            asyncio.wrap_future(future)
+            for future in self.downloader.submit_probes([m.url for m in targets], index, self.probe_size)
+        ], return_exceptions=True)
+        for match, res in zip(targets, results):
+            if isinstance(res, tuple):
+                (match.width, match.height) = res
+
+    def downloaded(self, future: asyncio.Future, url: str):
+        """Report finished download and queue thumbnail generation"""
+        self.step(t('Downloading `%(url)s`...') % {'url': url})
+        if self.thumbs and not future.cancelled() and not future.exception():
+            (status_code, file) = future.result()
+            if status_code == 200:
+                self.thumbs.request(file)
+
+    def split_results(self, matches: list[Match], results: list) -> tuple[list[Match], list[str]]:
+        """Split download results of a term into downloaded matches and skipped"""
+        (downloaded, skipped) = ([], [])
+        for match, res in zip(matches, results):
+            if isinstance(res, BaseException):
+                self.logger.info(f'Exception `{match.url}`: {res}')
+                skipped.append(f'{match.url} ({res})')
+                continue
+            (status_code, file) = res
+            if status_code == 200:
+                match.file = file
+                downloaded.append(match)
+            else:
+                skipped.append(f'{match.url} ({status_code})')
+        return (downloaded, skipped)
+
+    def collapse(self, index: int, matches: list[Match]) -> list[Match]:
+        """
+        Remove near-duplicates among term's downloaded matches (and those of
+        finished earlier terms with `dup_terms`, so a shared image stays with
+        the term with the lowest index regardless of finishing order), hashing
+        the thumbnails
+        """
+        (width, height) = (self.thumbs.width, self.thumbs.height) if self.thumbs else (dedupe.HASH_W * 8, dedupe.HASH_H * 8)
+        fingerprints = [dedupe.fingerprint(match.file, width, height, self.cache) for match in matches]
+        with self.lock:
+            earlier = [fp for i in sorted(self.fingerprints) if i < index for fp in self.fingerprints[i]] if self.dup_terms else []
+            fixed = len(earlier)
+            kept = [i - fixed for i in dedupe.collapse(earlier + fingerprints, self.dup_distance, fixed)]
+            if self.dup_terms:
+                self.fingerprints[index] = [fingerprints[i] for i in kept]
+        if len(kept) < len(matches):
+            self.logger.info(f'Collapsed {len(matches) - len(kept)} near-duplicate image(s)')
+        return [matches[i] for i in kept]
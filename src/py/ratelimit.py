@@ -0,0 +1,116 @@
+"""Search request rate limiting with adaptive backoff"""
+
+import time, random, threading, logging, requests
+from urllib.parse import urlparse
+
+REQUEST_TIMEOUT = 15 # Default timeout (seconds) of search requests
+
+class Cancelled(Exception):
+    """Rate limited request given up as the run was cancelled"""
+
+
+class TokenBucket:
+    """
+    Thread safe token bucket, `rate` tokens per second up to `burst`. A
+    penalty (backoff) blocks all acquirers until it has passed. Waiting
+    acquirers raise `Cancelled` as soon as the `cancelled` event is set.
+    """
+    def __init__(self, rate: float, burst: float, cancelled: threading.Event = None):
+        self.rate = rate
+        self.burst = max(1, burst)
+        self.tokens = self.burst
+        self.stamp = time.monotonic()
+        self.blocked_until = 0
+        self.cancelled = cancelled or threading.Event()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """Block until a token is available and take it"""
+        while True:
+            if self.cancelled.is_set():
+                raise Cancelled()
+            with self.lock:
+                now = time.monotonic()
+                if self.rate > 0:
+                    self.tokens = min(self.burst, self.tokens + (now - self.stamp) * self.rate)
+                else:
+                    self.tokens = self.burst
+                self.stamp = now
+                if now < self.blocked_until:
+                    wait = self.blocked_until - now
+                elif self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                else:
+                    wait = (1 - self.tokens) / self.rate
+            self.cancelled.wait(wait)
+
+    def penalize(self, delay: float):
+        """Block bucket for `delay` seconds (from now)"""
+        with self.lock:
+            self.blocked_until = max(self.blocked_until, time.monotonic() + delay)
+            self.tokens = 0
+
+
+class RateLimiter:
+    """
+    Token buckets per (engine, host), shared by all search requests in a run.
+    Requests answered with 429/5xx, a connection error or an invalid (e.g.
+    empty) response are retried with exponential backoff and jitter, the
+    backoff applies to all requests to that engine and host. `cancel` stops
+    waiting and retrying (pending requests raise `Cancelled`).
+    """
+    def __init__(self, rate: float, burst: float, retries: int, logger: logging.Logger, backoff: float = 1.0, backoff_max: float = 60.0):
+        self.rate = rate
+        self.burst = burst
+        self.retries = max(0, retries)
+        self.logger = logger
+        self.backoff = backoff
+        self.backoff_max = backoff_max
+        self.buckets: dict[tuple[str, str], TokenBucket] = {}
+        self.cancelled = threading.Event()
+        self.lock = threading.Lock()
+
+    def cancel(self):
+        """Abort backoff/rate limit waits and further retries"""
+        self.cancelled.set()
+
+    def bucket(self, engine: str, host: str) -> TokenBucket:
+        """Return bucket for engine and host, creating it if needed"""
+        with self.lock:
+            if not (bucket := self.buckets.get((engine, host))):
+                bucket = self.buckets[(engine, host)] = TokenBucket(self.rate, self.burst, self.cancelled)
+            return bucket
+
+    def delay(self, attempt: int, res: requests.Response) -> float:
+        """Backoff delay for attempt, honouring `Retry-After` (seconds) if present"""
+        try: return min(self.backoff_max, float(res.headers['Retry-After']))
+        except: pass
+        return min(self.backoff_max, self.backoff * 2 ** attempt) * random.uniform(0.5, 1.0)
+
+    def get(self, engine: str, url: str, valid=None, **kwargs) -> requests.Response:
+        """
+        Rate limited `requests.get`, `valid(response)` may reject responses that
+        should be retried, returns last response (or raises last exception)
+        when retries are exhausted. Requests time out after `REQUEST_TIMEOUT`
+        seconds unless given a `timeout`.
+        """
+        kwargs.setdefault('timeout', REQUEST_TIMEOUT)
+        bucket = self.bucket(engine, urlparse(url).hostname)
+        for attempt in range(self.retries + 1):
+            bucket.acquire()
+            (res, err) = (None, None)
+            try:
+                res = requests.get(url, **kwargs)
+                if res.status_code != 429 and res.status_code < 500 and res.content and (not valid or valid(res)):
+                    return res
+                reason = f'{res.status_code}, {len(res.content)} bytes'
+            except (requests.ConnectionError, requests.Timeout) as e:
+                err = e
+                reason = str(e)
+            if attempt < self.retries:
+                delay = self.delay(attempt, res)
+                self.logger.info(f'Backing off {engine} {url} {delay:.1f}s ({reason})')
+                bucket.penalize(delay)
+        if err: raise err
+        return res
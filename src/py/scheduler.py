@@ -0,0 +1,82 @@
+"""Priority scheduling of queued jobs"""
+
+import heapq, itertools, threading
+from concurrent.futures import Future
+
+class PriorityExecutor:
+    """
+    Thread pool where each queued job has a key (e.g. term index) and jobs
+    run in order of `priority(key)` (lowest first, ties in submission order).
+    Replacing the priority function reorders all jobs still queued.
+    """
+    def __init__(self, max_workers: int, thread_name_prefix: str = ''):
+        self.priority = lambda key: 0
+        self.queue: list[list] = []
+        self.seq = itertools.count()
+        self.cond = threading.Condition()
+        self.stopped = False
+        self.threads = [
+            threading.Thread(target=self.work, name=f'{thread_name_prefix}_{i}', daemon=True)
+            for i in range(max(1, max_workers))
+        ]
+        for thread in self.threads: thread.start()
+
+    def submit(self, key, fn, *args) -> Future:
+        """Queue `fn(*args)` with key, return future resolving to its result"""
+        future = Future()
+        with self.cond:
+            if self.stopped:
+                raise RuntimeError('cannot schedule new futures after shutdown')
+            heapq.heappush(self.queue, [self.priority(key), next(self.seq), key, future, fn, args])
+            self.cond.notify()
+        return future
+
+    def set_priority(self, priority):
+        """Set priority function `priority(key) -> comparable` and reorder queue"""
+        with self.cond:
+            self.priority = priority
+            for entry in self.queue:
+                entry[0] = priority(entry[2])
+            heapq.heapify(self.queue)
+
+    def shutdown(self, cancel: bool = False, wait: bool = True):
+        """
+        Stop workers once queue is empty, optionally cancelling queued jobs,
+        and (if `wait`) block until running jobs have finished
+        """
+        with self.cond:
+            self.stopped = True
+            if cancel:
+                for entry in self.queue: entry[3].cancel()
+                self.queue.clear()
+            self.cond.notify_all()
+        if wait:
+            for thread in self.threads:
+                if thread is not threading.current_thread(): thread.join()
+
+    def work(self):
+        while True:
+            with self.cond:
+                while not self.queue and not self.stopped:
+                    self.cond.wait()
+                if not self.queue:
+                    return
+                (_, _, _, future, fn, args) = heapq.heappop(self.queue)
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                future.set_result(fn(*args))
+            except BaseException as e:
+                future.set_exception(e)
+
+
+def focus_priority(focus: int):
+    """
+    Priority function ordering keys (term indices) `focus` first, then the
+    ones after it in order, then the ones before it nearest first
+    """
+    def priority(key):
+        if key is None or focus is None:
+            return (0, 0)
+        return (0, key - focus) if key >= focus else (1, focus - key)
+    return priority
@@ -0,0 +1,193 @@
+"""Thumbnail generation and caching"""
+
+import os, threading, logging
+from collections import OrderedDict
+from typing import Callable
+from aqt.qt import *
+from .cache import DownloadCache
+
+def read_scaled(file: str, width: int, height: int) -> QImage:
+    """
+    Read image file scaled to fit width x height (keeping aspect ratio). When
+    shrinking, the reader decodes at the target size directly (e.g. JPEG DCT
+    scaling) rather than decoding the full image and scaling it afterwards.
+    """
+    reader = QImageReader(file)
+    reader.setAutoTransform(True)
+    size = reader.size()
+    if not size.isValid():
+        return QImage(file).scaled(width, height, Qt.AspectRatioMode.KeepAspectRatio, Qt.TransformationMode.SmoothTransformation)
+    target = size.scaled(width, height, Qt.AspectRatioMode.KeepAspectRatio)
+    if target.width() < size.width():
+        reader.setScaledSize(target)
+    image = reader.read()
+    if not image.isNull() and image.size() != target: # Enlarge small images/transformed
+        image = image.scaled(width, height, Qt.AspectRatioMode.KeepAspectRatio, Qt.TransformationMode.SmoothTransformation)
+    return image
+
+
+def thumbnail(file: str, width: int, height: int) -> QImage:
+    """
+    Scale image file to fit width x height, centered on transparent
+    background (QImage rather than QPixmap so it can run outside GUI thread)
+    """
+    image = read_scaled(file, width, height)
+    if image.isNull():
+        return image
+    img = QImage(width, height, QImage.Format.Format_ARGB32_Premultiplied)
+    img.fill(Qt.GlobalColor.transparent)
+    painter = QPainter(img)
+    x = (width - image.width()) / 2
+    y = (height - image.height()) / 2
+    painter.drawImage(int(x), int(y), image)
+    painter.end()
+    return img
+
+
+def thumbnail_file(file: str, width: int, height: int) -> str:
+    """Path of on-disk thumbnail of file (stored next to it)"""
+    return f'{file}.thumb{width}x{height}.png'
+
+
+def cached_thumbnail(file: str, width: int, height: int, cache: DownloadCache = None) -> QImage:
+    """
+    Load thumbnail of file from disk, generating and saving it if missing
+    (counting it towards the size of file in `cache`, if cached there)
+    """
+    thumb = thumbnail_file(file, width, height)
+    img = QImage(thumb) if os.path.exists(thumb) else QImage()
+    if img.isNull():
+        img = thumbnail(file, width, height)
+        tmp = f'{thumb}.{threading.get_ident()}.tmp' # Also generated by duplicate detection
+        if not img.isNull() and img.save(tmp, 'PNG'):
+            old = os.path.getsize(thumb) if os.path.exists(thumb) else 0
+            os.replace(tmp, thumb)
+            if cache:
+                cache.add_size(file, os.path.getsize(thumb) - old)
+    return img
+
+
+class ImageJob(QRunnable):
+    """Load image in thread pool and add to cache"""
+    def __init__(self, cache: 'ImageCache', key: tuple[str, int, int]):
+        super().__init__()
+        self.cache = cache
+        self.key = key
+
+    def run(self):
+        self.cache.generate(self.key)
+
+
+class ImageCache(QObject):
+    """
+    Memory bounded LRU cache of images scaled to width x height, keyed by
+    file and size. Missing images are loaded (`load(file, width, height)`,
+    returning a null image on failure) in a thread pool, `ready(file)` is emitted (in the GUI thread
+    through queued connection) when done. Images that fail to load are not
+    retried until `clear`, pinned images (`pin`) are not evicted.
+    """
+    ready = pyqtSignal(str)
+
+    def __init__(self, parent: QObject, width: int, height: int, max_size: int, logger: logging.Logger, threads: int, load: Callable[[str, int, int], QImage]):
+        super().__init__(parent)
+        self.load = load
+        self.width = width
+        self.height = height
+        self.max_size = max_size
+        self.logger = logger
+        self.images: OrderedDict[tuple[str, int, int], QImage] = OrderedDict()
+        self.size = 0
+        self.pending: set[tuple[str, int, int]] = set()
+        self.failed: set[tuple[str, int, int]] = set()
+        self.pinned: set[tuple[str, int, int]] = set()
+        self.lock = threading.Lock()
+        self.pool = QThreadPool(self)
+        self.pool.setMaxThreadCount(max(1, threads))
+
+    def key(self, file: str) -> tuple[str, int, int]:
+        return (file, self.width, self.height)
+
+    def get(self, file: str) -> QImage:
+        """Return cached image of file (marking it as recently used) or None"""
+        with self.lock:
+            if img := self.images.get(self.key(file)):
+                self.images.move_to_end(self.key(file))
+            return img
+
+    def pin(self, files: list[str]):
+        """Keep images of files (at current size) from being evicted, replacing previously pinned ones"""
+        with self.lock:
+            self.pinned = {self.key(file) for file in files if file}
+
+    def request(self, file: str, priority: int = 0):
+        """Queue loading of image of file unless cached, queued or failed"""
+        key = self.key(file)
+        with self.lock:
+            if not file or key in self.pending or key in self.images or key in self.failed:
+                return
+            self.pending.add(key)
+        self.pool.start(ImageJob(self, key), priority)
+
+    def generate(self, key: tuple[str, int, int]):
+        """Load image and add to cache (run in thread pool)"""
+        try:
+            img = self.load(*key)
+            if img.isNull(): img = None
+        except Exception as e:
+            self.logger.warning(f'Image `{key[0]}`: {e}')
+            img = None
+        with self.lock:
+            self.pending.discard(key)
+            if img:
+                self.put(key, img)
+            else:
+                self.failed.add(key)
+        if img:
+            self.ready.emit(key[0])
+
+    def put(self, key: tuple[str, int, int], img: QImage):
+        """Add image and evict least recently used unpinned ones (caller holds lock)"""
+        if old := self.images.pop(key, None):
+            self.size -= old.sizeInBytes()
+        self.images[key] = img
+        self.size += img.sizeInBytes()
+        if self.size > self.max_size:
+            for old in [k for k in self.images if k != key and k not in self.pinned]:
+                if self.size <= self.max_size: break
+                self.size -= self.images.pop(old).sizeInBytes()
+
+    def clear(self):
+        """Drop queued jobs (running ones still finish) and forget failed images"""
+        self.pool.clear()
+        with self.lock:
+            self.pending.clear()
+            self.failed.clear()
+
+
+class ThumbnailCache(ImageCache):
+    """
+    Thumbnail cache, thumbnails are loaded from/generated to a PNG next to
+    the image file (see `thumbnail_file`), accounted to the download `cache`
+    if set
+    """
+    cache: DownloadCache = None
+
+    def __init__(self, parent: QObject, width: int, height: int, max_size: int, logger: logging.Logger):
+        super().__init__(
+            parent, width, height, max_size, logger, QThread.idealThreadCount() - 1,
+            lambda file, width, height: cached_thumbnail(file, width, height, self.cache)
+        )
+
+
+class ZoomCache(ImageCache):
+    """
+    Cache of zoom sized images (the current term's, loaded in the background
+    with a single thread to not compete with thumbnail generation)
+    """
+    def __init__(self, parent: QObject, max_size: int, logger: logging.Logger):
+        super().__init__(parent, 0, 0, max_size, logger, 1, read_scaled)
+
+    def resize(self, width: int, height: int):
+        """Set size of zoomed images (already cached images of other size are unused)"""
+        self.width = width
+        self.height = height